@@ -15,10 +15,14 @@ if sys.version_info[0] < 3:
 
 import os
 import csv
+import copy
 import math
+import time
 import shutil
 import datetime
+import itertools
 import subprocess
+import multiprocessing
 import xml.etree.ElementTree as ET
 
 import numpy as np
@@ -27,6 +31,14 @@ import matplotlib.pyplot as plt
 from scipy import stats as scistats
 matplotlib.rcParams.update({'errorbar.capsize': 5})
 
+import resource_sampler
+import trajectory_msd
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None # Watch mode falls back to polling directory modification times
+
 
 BINARIES_DIR = './binaries/'
 PARAMSETS_DIR = './parameter_sets/'
@@ -37,9 +49,35 @@ INDIVIDUAL_MSDS_DIR_NAME = 'Individual MSDs'
 PARAMSETS_FILE_NAME = 'parameter_sets.xml'
 JOB_SET_INFO_FILE_NAME = 'job_set_info.xml'
 DISCREPANCIES_FILE_NAME = 'variables.txt'
+PLOT_SETTINGS_FILE_NAME = 'plot_settings.xml'
+MSD_SETTINGS_FILE_NAME = 'msd_settings.xml'
 CLF_RUNNING = 'RUNNING'
 CLF_PENDING = 'PENDING'
 CLF_FINISHED = 'FINISHED'
+JVM_PROFILE_PATH = './jvm_profile.xml' # Profile saved from a tuning sweep, used for all new jobscripts
+DEFAULT_JVM_PROFILE = { 'cpus_per_task' : 8, 'cpu_threads' : 8, 'heap' : '1G', 'parallel_gc_threads' : 1, 'malloc_arena_max' : 8 }
+JVM_PROFILE_ATTRIBUTES = { 'cpus_per_task' : 'CpusPerTask', 'cpu_threads' : 'CpuThreads', 'heap' : 'Heap', 'parallel_gc_threads' : 'ParallelGcThreads', 'malloc_arena_max' : 'MallocArenaMax' }
+TUNING_GRID = { 'cpus_per_task' : [ 4, 8 ], 'cpu_threads' : [ 4, 8 ], 'heap' : [ '1G', '2G' ], 'parallel_gc_threads' : [ 1, 2 ], 'malloc_arena_max' : [ 2, 8 ] }
+MODE_TUNING = 'Tuning'
+TUNING_INSTANCES_PER_PARAMSET = 1 # Tuning sweeps are short calibration job-sets of this size
+TUNING_RUNS_PER_INSTANCE = 5
+TUNING_TIME_LIMIT = '01:00:00'
+PARTITIONS = [ 'nodes', 'week' ] # Candidates for load-aware dispatch, in order of preference
+WATCH_POLL_INTERVAL = 60 # Seconds between checks for filesystem activity
+WATCH_RECHECK_INTERVAL = 900 # Seconds after which running job-sets are checked with SLURM even without activity
+WATCH_ANALYSIS_ATTEMPTS = 4 # Analyses that find no results are retried after WATCH_RECHECK_INTERVAL, up to this many times
+PYTHON_MODULE = 'data/scikit-learn/0.20.2-foss-2018b-Python-3.6.6'
+ANALYSIS_CPUS = 8
+ANALYSIS_MEMORY = '16gb'
+ANALYSIS_TIME_LIMIT = '02:00:00'
+MONITOR_STATES = [ 'PENDING', 'RUNNING', 'COMPLETED', 'FAILED', 'TIMEOUT', 'CANCELLED', 'OUT_OF_MEMORY', 'NODE_FAIL' ] # Any other state is counted as unknown
+MONITOR_STATE_LABELS = [ 'PD', 'R', 'CD', 'F', 'TO', 'CA', 'OOM', 'NF', '?' ]
+MONITOR_FAILED_STATES = [ 'FAILED', 'TIMEOUT', 'OUT_OF_MEMORY', 'NODE_FAIL' ]
+MONITOR_SORTS = [ 'ID', 'Slowest', 'Most failed' ]
+MONITOR_PERCENTILES = [ 10, 50, 90 ] # Of runs completed by each parameter set's instances
+MONITOR_PAGE_SIZE = 25 # Parameter sets per page of the summary view
+MONITOR_TOP_N = 5
+MONITOR_DETAIL_MAX_CELLS = 400 # Job-sets with more instances than this open in the summary view
 OBS_TIMEPOINTS = [ 0, 0.03333, 0.06666, 0.09999, 0.13332, 0.16665, 0.19998, 0.23331, 0.26664, 0.29997, 0.3333, 0.36663, 0.39996, 0.43329, 0.46662, 0.49995, 0.53328, 0.56661, 0.59994, 0.63327, 0.6666, 0.69993, 0.73326, 0.76659, 0.79992, 0.83325, 0.86658, 0.89991, 0.93324, 0.96657, 0.9999 ]
 OBS_DATAPOINTS = [ 0, 0.0029767, 0.0050122, 0.0072264, 0.0086977, 0.009889, 0.010522, 0.010981, 0.011506, 0.012154, 0.012248, 0.012361, 0.012455, 0.012771, 0.012979, 0.013139, 0.013295, 0.013527, 0.013463, 0.013404, 0.013382, 0.013477, 0.013626, 0.013696, 0.013713, 0.01374, 0.013832, 0.013819, 0.013804, 0.013799, 0.013784 ]
 
@@ -66,6 +104,10 @@ def title(page_name):
     print()
 
 
+def log(job_set_name, *message):
+    print(datetime.datetime.now().strftime('%d/%m/%Y %H:%M:%S'), job_set_name, *message)
+
+
 def print_table(rows, col_widths):
     num_cols = max(len(row) for row in rows)
     col_widths = list(col_widths)
@@ -90,117 +132,266 @@ def least_squares_score(timepoints, msds):
     return score
 
 
+def query_partition_loads(partition_names):
+    loads = { name : { 'cpus_idle' : 0,
+                       'cpus_total' : 0,
+                       'cpus_pending' : 0,
+                       'time_limit' : None } for name in partition_names }
+    partition_names_str = ','.join(partition_names)
+    # Idle and total CPUs (sinfo reports these as allocated/idle/other/total)
+    try:
+        p = subprocess.Popen([ 'sinfo', '-h', '-p', partition_names_str, '-o', '%R|%C|%l' ], stdout=subprocess.PIPE)
+        stdout, stderr = p.communicate()
+    except OSError:
+        return None
+    for line in stdout.decode().split('\n'):
+        if line.count('|') != 2:
+            continue
+        name, cpus_str, time_limit_str = line.strip().split('|')
+        if name not in loads:
+            continue
+        cpus_allocated, cpus_idle, cpus_other, cpus_total = [ int(x) for x in cpus_str.split('/') ]
+        loads[name]['cpus_idle'] += cpus_idle
+        loads[name]['cpus_total'] += cpus_total
+        if time_limit_str not in ('infinite', 'UNLIMITED'):
+            loads[name]['time_limit'] = resource_sampler.parse_duration(time_limit_str)
+    # Pending backlog, with array jobs expanded so that every waiting task is counted
+    try:
+        p = subprocess.Popen([ 'squeue', '-h', '-r', '-p', partition_names_str, '-t', 'PENDING', '-o', '%P|%C' ], stdout=subprocess.PIPE)
+        stdout, stderr = p.communicate()
+    except OSError:
+        return None
+    for line in stdout.decode().split('\n'):
+        if line.count('|') != 1:
+            continue
+        names_str, cpus_str = line.strip().split('|')
+        # Jobs submitted to several partitions count against each of them
+        for name in names_str.split(','):
+            if name in loads:
+                loads[name]['cpus_pending'] += int(cpus_str)
+    return loads
+
+
+def plan_partitions(partition_loads, num_job_groups, cpus_per_job_group, time_limit):
+    # Send each job group to the partition where it is expected to start soonest, estimated as the
+    # number of CPUs queued ahead of it (pending minus idle) relative to the size of the partition
+    usable_names = [ name for name, load in partition_loads.items()
+                     if load['cpus_total'] > 0 and (load['time_limit'] is None or load['time_limit'] >= time_limit) ]
+    if len(usable_names) == 0:
+        return None
+    backlogs = { name : partition_loads[name]['cpus_pending'] - partition_loads[name]['cpus_idle'] for name in usable_names }
+    assignments = [ ]
+    for _ in range(num_job_groups):
+        name = min(usable_names, key=lambda x: (backlogs[x] + cpus_per_job_group) / partition_loads[x]['cpus_total'])
+        assignments.append(name)
+        backlogs[name] += cpus_per_job_group
+    return assignments
+
+
+def prompt_fallback_partition(partition_names, num_job_groups):
+    # Returns a partition for each job group, None to leave the choice to SLURM, or False to cancel the launch
+    print('None of ' + ', '.join(partition_names) + ' can currently take these job groups (unknown, empty, or time limit too short).')
+    print('Enter a partition to send every job group to, D to use the cluster default partition, or C to cancel')
+    while True:
+        choice = input('> ').strip()
+        if choice.upper() == 'C':
+            return False
+        if choice.upper() == 'D':
+            print()
+            return None
+        if len(choice) > 0:
+            print()
+            return [ choice ] * num_job_groups
+
+
+def jvm_profile_attributes(jvm_profile):
+    return { name : str(jvm_profile[key]) for key, name in JVM_PROFILE_ATTRIBUTES.items() }
+
+
+def parse_jvm_profile(element):
+    jvm_profile = dict(DEFAULT_JVM_PROFILE)
+    for key, name in JVM_PROFILE_ATTRIBUTES.items():
+        value = element.get(name)
+        if value is not None:
+            jvm_profile[key] = value if key == 'heap' else int(value)
+    return jvm_profile
+
+
+def load_jvm_profile():
+    if not os.path.isfile(JVM_PROFILE_PATH):
+        return dict(DEFAULT_JVM_PROFILE)
+    return parse_jvm_profile(ET.parse(JVM_PROFILE_PATH).getroot())
+
+
+def save_jvm_profile(jvm_profile):
+    tree = ET.ElementTree(ET.Element('JvmProfile', jvm_profile_attributes(jvm_profile)))
+    tree.write(JVM_PROFILE_PATH)
+
+
+def describe_jvm_profile(jvm_profile):
+    return 'cpus-per-task=' + str(jvm_profile['cpus_per_task']) + \
+           ' CPU_THREADS=' + str(jvm_profile['cpu_threads']) + \
+           ' -Xmx' + jvm_profile['heap'] + \
+           ' ParallelGCThreads=' + str(jvm_profile['parallel_gc_threads']) + \
+           ' MALLOC_ARENA_MAX=' + str(jvm_profile['malloc_arena_max'])
+
+
+def tuning_grid():
+    # Every combination of the grid, leaving out simulations with more threads than allocated CPUs
+    keys = list(TUNING_GRID.keys())
+    jvm_profiles = [ ]
+    for values in itertools.product(*[ TUNING_GRID[x] for x in keys ]):
+        jvm_profile = dict(zip(keys, values))
+        if jvm_profile['cpu_threads'] <= jvm_profile['cpus_per_task']:
+            jvm_profiles.append(jvm_profile)
+    return jvm_profiles
+
+
 def setup_environment():
     for dir_name in (BINARIES_DIR, PARAMSETS_DIR, SIMULATIONS_DIR):
         if not os.path.isdir(dir_name):
             os.mkdir(dir_name)
 
 
+def load_job_set(job_set_name):
+    job_set_path = os.path.join(SIMULATIONS_DIR, job_set_name)
+    job_set = { }
+    # Get job IDs and run distribution info
+    job_group_ids = [ ]
+    job_group_partitions = [ ]
+    paramset_title = None
+    instances_per_paramset = None
+    runs_per_instance = None
+    instance_time_limit = None
+    analysis_job_id = None
+    mode = None
+    jvm_profiles = [ ]
+    try:
+        tree = ET.parse(os.path.join(job_set_path, JOB_SET_INFO_FILE_NAME))
+        root = tree.getroot()
+        for element in root:
+            if element.tag == 'JobGroups':
+                for job_group in element:
+                    job_group_id = int(job_group.get('id'))
+                    job_group_ids.append(job_group_id)
+                    job_group_partitions.append(job_group.get('partition'))
+            elif element.tag == 'AnalysisJob':
+                analysis_job_id = int(element.get('id'))
+            elif element.tag == 'JvmProfiles':
+                for jvm_profile in element:
+                    jvm_profiles.append(parse_jvm_profile(jvm_profile))
+            elif element.tag == 'Parameter':
+                name, value = element.get('name'), element.get('value')
+                if name == 'ParamsetTitle':
+                    paramset_title = value
+                if name == 'InstancesPerParamset':
+                    instances_per_paramset = int(value)
+                if name == 'RunsPerInstance':
+                    runs_per_instance = int(value)
+                if name == 'InstanceTimeLimit':
+                    instance_time_limit = int(value)
+                if name == 'Mode':
+                    mode = value
+    except:
+        raise ValueError('Error parsing ' + JOB_SET_INFO_FILE_NAME + ' for job-set ' + job_set_name)
+    jobs = { } # Keyed by job ID
+    job_ids = { } # Keyed by job allocation number
+    for job_group_id in job_group_ids:
+        for instance_id in range(instances_per_paramset):
+            job_id = str(job_group_id) + '_' + str(instance_id)
+            paramset_id = job_group_ids.index(job_group_id)
+            jobs[job_id] = { 'job_group_id' : job_group_id,
+                             'partition' : job_group_partitions[paramset_id],
+                             'paramset_id' : paramset_id,
+                             'instance_id' : instance_id,
+                             'job_alloc_num' : None,
+                             'state' : None,
+                             'time_elapsed' : 0,
+                             'runs_completed' : 0 }
+    # Get SLURM info for each job (instance)
+    job_group_ids = sorted(set([ x['job_group_id'] for x in jobs.values() ]))
+    job_group_ids_str = ','.join(str(x) for x in job_group_ids)
+    p = subprocess.Popen([ 'sacct', '-j', job_group_ids_str, '-o', 'JobID,JobIDRaw,State,ElapsedRaw,TimelimitRaw', '-P', '-X', '--noheader' ], stdout=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+    sacct_failed = p.returncode != 0 # e.g. while the accounting database is unreachable
+    for line in stdout.decode().split('\n'):
+        if len(line) == 0:
+            continue
+        job_id, job_alloc_num_str, state, time_elapsed_str, time_limit_str = line.strip().split('|')
+        state = state.split(' ')[0] # First word is enough
+        # Deal with unallocated ID ranges
+        if '[' in job_id:
+            job_group_id_str, job_instance_id_str = job_id.split('_')
+            instance_id_range = [ int(x) for x in job_instance_id_str[1:-1].split('-') ]
+            for instance_id in range(instance_id_range[0], instance_id_range[1]+1):
+                job_id = job_group_id_str + '_' + str(instance_id)
+                jobs[job_id]['state'] = state
+                jobs[job_id]['time_elapsed'] = int(time_elapsed_str)
+        else:
+            job_alloc_num = int(job_alloc_num_str)
+            jobs[job_id]['job_alloc_num'] = job_alloc_num
+            jobs[job_id]['state'] = state
+            jobs[job_id]['time_elapsed'] = int(time_elapsed_str)
+            job_ids[job_alloc_num] = job_id
+    # Count completed runs for each instance
+    for log_name in os.listdir(os.path.join(job_set_path, 'output_std')):
+        if not log_name.lower().endswith('.log'):
+            continue
+        job_alloc_num = int(log_name[4:-4])
+        if job_alloc_num not in job_ids:
+            continue # Not (yet) reported by sacct, e.g. while the accounting database is unreachable
+        job_id = job_ids[job_alloc_num]
+        log_path = os.path.join(job_set_path, 'output_std', log_name)
+        with open(log_path, 'r') as infile:
+            for line in infile.readlines():
+                if line.strip().endswith('run completed'):
+                    num = int(line.strip().split(' ')[2])
+                    if jobs[job_id]['runs_completed'] is None or \
+                       num > jobs[job_id]['runs_completed']:
+                        jobs[job_id]['runs_completed'] = num
+    # Determine job-set classification, treating it as finished if analysis has already been performed
+    # If sacct failed, instances it did not report have an unknown state, so cannot be taken to have finished;
+    # if it succeeded, their accounting records have most likely been purged
+    classification = None
+    job_states = set([ x['state'] for x in jobs.values() ])
+    if CLF_PENDING in job_states or CLF_RUNNING in job_states:
+        classification = CLF_RUNNING
+    elif RESULTS_DIR_NAME in os.listdir(job_set_path):
+        classification = CLF_FINISHED
+    elif sacct_failed and None in job_states:
+        classification = CLF_RUNNING
+    else:
+        classification = CLF_PENDING
+    job_set['jobs'] = jobs
+    job_set['classification'] = classification
+    job_set['paramset_title'] = paramset_title
+    job_set['num_paramsets'] = len(job_group_ids)
+    job_set['instances_per_paramset'] = instances_per_paramset
+    job_set['runs_per_instance'] = runs_per_instance
+    job_set['instance_time_limit'] = instance_time_limit
+    job_set['analysis_job_id'] = analysis_job_id
+    job_set['mode'] = mode
+    # Job-sets queued before JVM profiles were recorded all used the defaults
+    if len(jvm_profiles) != len(job_group_ids):
+        jvm_profiles = [ dict(DEFAULT_JVM_PROFILE) for _ in job_group_ids ]
+    job_set['jvm_profiles'] = jvm_profiles
+    return job_set
+
+
 def update_job_set_data():
     global JOB_SETS
     print()
     print('Loading...')
-    job_ids = { } # Keyed by job allocation number
     # For each job-set directory...
     for job_set_name in os.listdir(SIMULATIONS_DIR):
         job_set_path = os.path.join(SIMULATIONS_DIR, job_set_name)
         if not os.path.isdir(job_set_path):
             continue
-        JOB_SETS[job_set_name] = { }
-        # Check if analysis has already been performed, and skip it if so
-        if RESULTS_DIR_NAME in os.listdir(job_set_path):
-            JOB_SETS[job_set_name]['classification'] = CLF_FINISHED
-        # Get job IDs and run distribution info
-        job_group_ids = [ ]
-        paramset_title = None
-        instances_per_paramset = None
-        runs_per_instance = None
-        instance_time_limit = None
         try:
-            tree = ET.parse(os.path.join(job_set_path, JOB_SET_INFO_FILE_NAME))
-            root = tree.getroot()
-            for element in root:
-                if element.tag == 'JobGroups':
-                    for job_group in element:
-                        job_group_id = int(job_group.get('id'))
-                        job_group_ids.append(job_group_id)
-                elif element.tag == 'Parameter':
-                    name, value = element.get('name'), element.get('value')
-                    if name == 'ParamsetTitle':
-                        paramset_title = value
-                    if name == 'InstancesPerParamset':
-                        instances_per_paramset = int(value)
-                    if name == 'RunsPerInstance':
-                        runs_per_instance = int(value)
-                    if name == 'InstanceTimeLimit':
-                        instance_time_limit = int(value)
-        except:
-            print('Error parsing', JOB_SET_INFO_FILE_NAME, 'for job-set', job_set_name)
+            JOB_SETS[job_set_name] = load_job_set(job_set_name)
+        except ValueError as e:
+            print(e)
             exit(1)
-        jobs = { } # Keyed by job ID
-        for job_group_id in job_group_ids:
-            for instance_id in range(instances_per_paramset):
-                job_id = str(job_group_id) + '_' + str(instance_id)
-                paramset_id = job_group_ids.index(job_group_id)
-                jobs[job_id] = { 'job_group_id' : job_group_id,
-                                 'paramset_id' : paramset_id,
-                                 'instance_id' : instance_id,
-                                 'job_alloc_num' : None,
-                                 'state' : None,
-                                 'time_elapsed' : 0,
-                                 'runs_completed' : 0 }
-        # Get SLURM info for each job (instance)
-        job_group_ids = sorted(set([ x['job_group_id'] for x in jobs.values() ]))
-        job_group_ids_str = ','.join(str(x) for x in job_group_ids)
-        p = subprocess.Popen([ 'sacct', '-j', job_group_ids_str, '-o', 'JobID,JobIDRaw,State,ElapsedRaw,TimelimitRaw', '-P', '-X', '--noheader' ], stdout=subprocess.PIPE)
-        stdout, stderr = p.communicate()
-        for line in stdout.decode().split('\n'):
-            if len(line) == 0:
-                continue
-            job_id, job_alloc_num_str, state, time_elapsed_str, time_limit_str = line.strip().split('|')
-            state = state.split(' ')[0] # First word is enough
-            # Deal with unallocated ID ranges
-            if '[' in job_id:
-                job_group_id_str, job_instance_id_str = job_id.split('_')
-                instance_id_range = [ int(x) for x in job_instance_id_str[1:-1].split('-') ]
-                for instance_id in range(instance_id_range[0], instance_id_range[1]+1):
-                    job_id = job_group_id_str + '_' + str(instance_id)
-                    jobs[job_id]['state'] = state
-                    jobs[job_id]['time_elapsed'] = int(time_elapsed_str)
-            else:
-                job_alloc_num = int(job_alloc_num_str)
-                jobs[job_id]['job_alloc_num'] = job_alloc_num
-                jobs[job_id]['state'] = state
-                jobs[job_id]['time_elapsed'] = int(time_elapsed_str)
-                job_ids[job_alloc_num] = job_id
-        # Count completed runs for each instance
-        for log_name in os.listdir(os.path.join(job_set_path, 'output_std')):
-            if not log_name.lower().endswith('.log'):
-                continue
-            job_alloc_num = int(log_name[4:-4])
-            job_id = job_ids[job_alloc_num]
-            log_path = os.path.join(job_set_path, 'output_std', log_name)
-            with open(log_path, 'r') as infile:
-                for line in infile.readlines():
-                    if line.strip().endswith('run completed'):
-                        num = int(line.strip().split(' ')[2])
-                        if jobs[job_id]['runs_completed'] is None or \
-                           num > jobs[job_id]['runs_completed']:
-                            jobs[job_id]['runs_completed'] = num
-        # Determine job-set classification
-        classification = None
-        job_states = set([ x['state'] for x in jobs.values() ])
-        if CLF_PENDING in job_states or CLF_RUNNING in job_states:
-            classification = CLF_RUNNING
-        else:
-            classification = CLF_PENDING
-        JOB_SETS[job_set_name]['jobs'] = jobs
-        JOB_SETS[job_set_name]['classification'] = classification
-        JOB_SETS[job_set_name]['paramset_title'] = paramset_title
-        JOB_SETS[job_set_name]['num_paramsets'] = len(job_group_ids)
-        JOB_SETS[job_set_name]['instances_per_paramset'] = instances_per_paramset
-        JOB_SETS[job_set_name]['runs_per_instance'] = runs_per_instance
-        JOB_SETS[job_set_name]['instance_time_limit'] = instance_time_limit
 
 
 def main_menu():
@@ -224,19 +415,49 @@ def main_menu():
     print('2) Monitor running job-sets')
     print('3) Analyse finished job-sets')
     print('4) Cancel running job-sets')
+    print('5) Watch job-sets and analyse them when they finish')
     print('Q) Quit')
     choice = None
-    options = set(str(x+1) for x in range(4))
+    options = set(str(x+1) for x in range(5))
     while choice not in options:
         choice = input('> ').strip().upper()
         if choice == 'Q':
             clear_screen()
             exit(0)
     choice_index = int(choice)-1
-    chosen_function = [ queue, monitor, analyse, cancel ][choice_index]
+    chosen_function = [ queue, monitor, analyse, cancel, watch ][choice_index]
     chosen_function()
 
 
+def read_paramsets_root(paramsets_file_path):
+    # Parameter sets files start with a comment, so only the EXPERIMENT element is parsed
+    paramsets_file_content = open(paramsets_file_path, 'r').read()
+    start_index = paramsets_file_content.index('<EXPERIMENT>')
+    end_index = paramsets_file_content.index('</EXPERIMENT>')
+    paramsets_file_content = paramsets_file_content[start_index:end_index+13]
+    return ET.fromstring(paramsets_file_content)
+
+
+def write_jobscript(jobscript_path, jvm_profile, binary_name, run_time_str, instances_per_paramset, email=None):
+    with open(jobscript_path, 'w') as outfile:
+        outfile.write('#!/bin/bash\n')
+        outfile.write('#SBATCH --job-name=omd_sim\n')
+        if email is not None:
+            outfile.write('#SBATCH --mail-type=ALL\n')
+            outfile.write('#SBATCH --mail-user=' + email + '\n')
+        outfile.write('#SBATCH --cpus-per-task=' + str(jvm_profile['cpus_per_task']) + '\n')
+        outfile.write('#SBATCH --mem=4gb\n')
+        outfile.write('#SBATCH --time=' + run_time_str + '\n')
+        outfile.write('#SBATCH --output=./output_std/omds%j.log\n')
+        outfile.write('#SBATCH --error=./output_std/omds%j.err\n')
+        outfile.write('#SBATCH --account=biol-stdbom-2019\n')
+        outfile.write('#SBATCH --array=0-' + str(instances_per_paramset-1) + '\n')
+        outfile.write('module load lang/Java/1.8.0_212\n')
+        outfile.write('export MALLOC_ARENA_MAX=' + str(jvm_profile['malloc_arena_max']) + '\n')
+        outfile.write('vmArgs="-Xmx' + jvm_profile['heap'] + ' -XX:ParallelGCThreads=' + str(jvm_profile['parallel_gc_threads']) + ' -jar"\n')
+        outfile.write('java $vmArgs ./' + binary_name + ' ' + PARAMSETS_FILE_NAME + ' ./output_files $PSET_ID $SLURM_ARRAY_TASK_ID')
+
+
 def queue():
     clear_screen()
     title('QUEUE')
@@ -253,22 +474,42 @@ def queue():
             return
     choice_index = int(choice)-1
     # Get configuration from user
+    num_paramsets = len(read_paramsets_root(os.path.join(PARAMSETS_DIR, paramsets_file_names[choice_index])).findall('PARAMETERS'))
     print()
-    print('How many instances per parameter set?')
-    instances_per_paramset = int(input('> ').strip())
-    print()
-    print('How many runs per instance?')
-    runs_per_instance = int(input('> ').strip())
-    total_runs = instances_per_paramset * runs_per_instance
-    print()
-    print('Total number of runs will be', str(total_runs) + ',', 'split over', instances_per_paramset, 'instance(s) per parameter set.')
-    print()
-    print('Run time limit (hh:mm:ss)')
-    run_time_str = input('> ').strip()
+    print('Run a JVM tuning sweep? Enter the ID of the parameter set to tune with (0-' + str(num_paramsets-1) + '), or leave blank to queue normally')
+    tuning_paramset_id = None
+    while True:
+        tuning_paramset_str = input('> ').strip()
+        if tuning_paramset_str == '':
+            break
+        if tuning_paramset_str.isdigit() and int(tuning_paramset_str) < num_paramsets:
+            tuning_paramset_id = int(tuning_paramset_str)
+            print(len(tuning_grid()), 'configurations will be queued, each as its own parameter set.')
+            break
+    if tuning_paramset_id is None:
+        print()
+        print('How many instances per parameter set?')
+        instances_per_paramset = int(input('> ').strip())
+        print()
+        print('How many runs per instance?')
+        runs_per_instance = int(input('> ').strip())
+        total_runs = instances_per_paramset * runs_per_instance
+        print()
+        print('Total number of runs will be', str(total_runs) + ',', 'split over', instances_per_paramset, 'instance(s) per parameter set.')
+        print()
+        print('Run time limit (hh:mm:ss)')
+        run_time_str = input('> ').strip()
+    else:
+        instances_per_paramset = TUNING_INSTANCES_PER_PARAMSET
+        runs_per_instance = TUNING_RUNS_PER_INSTANCE
+        run_time_str = TUNING_TIME_LIMIT
+        print('Each configuration will run', instances_per_paramset, 'instance(s) of', runs_per_instance, 'runs, with a time limit of', run_time_str + '.')
     instance_time_limit = sum(int(x) * 60**i for i, x in enumerate(reversed(run_time_str.split(':'))))
     print()
-    print('Partition name (leave blank for default: \'nodes\')')
-    partition_name = input('> ').strip()
+    print('Partition name(s) (comma separated, leave blank for load-aware dispatch over: ' + ', '.join(PARTITIONS) + ')')
+    partition_names = [ x.strip() for x in input('> ').strip().split(',') if len(x.strip()) > 0 ]
+    if len(partition_names) == 0:
+        partition_names = list(PARTITIONS)
     print()
     print('Email alerts?')
     do_alerts = input('> ').strip().upper() in ['Y', 'YES']
@@ -291,11 +532,7 @@ def queue():
     paramset_values_default = { }
     paramsets_file_name = sorted([ x for x in paramsets_file_names if 'default' in x and x.lower().endswith('.xml') ])[-1]
     paramsets_file_path =  os.path.join(PARAMSETS_DIR, paramsets_file_name)
-    paramsets_file_content = open(paramsets_file_path, 'r').read()
-    start_index = paramsets_file_content.index('<EXPERIMENT>')
-    end_index = paramsets_file_content.index('</EXPERIMENT>')
-    paramsets_file_content = paramsets_file_content[start_index:end_index+13]
-    root = ET.fromstring(paramsets_file_content)
+    root = read_paramsets_root(paramsets_file_path)
     num_paramsets = len(root.findall('PARAMETERS'))
     for paramset in root:
         for param in paramset:
@@ -305,20 +542,36 @@ def queue():
     paramset_values_chosen = { }
     paramsets_file_name = paramsets_file_names[choice_index]
     paramsets_file_path = os.path.join(PARAMSETS_DIR, paramsets_file_name)
-    paramsets_file_content = open(paramsets_file_path, 'r').read()
-    start_index = paramsets_file_content.index('<EXPERIMENT>')
-    end_index = paramsets_file_content.index('</EXPERIMENT>')
-    paramsets_file_content = paramsets_file_content[start_index:end_index+13]
-    root = ET.fromstring(paramsets_file_content)
+    root = read_paramsets_root(paramsets_file_path)
+    # CPU_THREADS is only taken from a JVM profile that was deliberately chosen, never from the defaults
+    override_cpu_threads = tuning_paramset_id is not None or os.path.isfile(JVM_PROFILE_PATH)
+    replaced_cpu_threads = [ ]
+    if tuning_paramset_id is None:
+        jvm_profiles = [ load_jvm_profile() for _ in root.findall('PARAMETERS') ]
+    else:
+        # Replace the parameter sets with a copy of the chosen one for each configuration
+        jvm_profiles = tuning_grid()
+        tuning_paramset = root.findall('PARAMETERS')[tuning_paramset_id]
+        for paramset in root.findall('PARAMETERS'):
+            root.remove(paramset)
+        for _ in jvm_profiles:
+            root.append(copy.deepcopy(tuning_paramset))
     num_paramsets = len(root.findall('PARAMETERS'))
-    for paramset in root:
+    for paramset_id, paramset in enumerate(root.findall('PARAMETERS')):
         for param in paramset:
             name, value = param.get('NAME'), param.get('VALUE')
             if name == 'N_PROTEINS':
                 param.set('VALUE', str(runs_per_instance))
+            if name == 'CPU_THREADS' and override_cpu_threads and value != str(jvm_profiles[paramset_id]['cpu_threads']):
+                replaced_cpu_threads.append('PS' + str(paramset_id) + ' (' + str(value) + ')')
+                value = str(jvm_profiles[paramset_id]['cpu_threads'])
+                param.set('VALUE', value)
             if name not in paramset_values_chosen:
                 paramset_values_chosen[name] = [ ]
             paramset_values_chosen[name].append(value)
+    if tuning_paramset_id is None and len(replaced_cpu_threads) > 0:
+        print('NOTICE: CPU_THREADS replaced with ' + str(jvm_profiles[0]['cpu_threads']) + ' from ' + JVM_PROFILE_PATH + ' for:', ', '.join(replaced_cpu_threads))
+        print()
     paramsets_xml = ET.tostring(root, encoding='utf8', method='xml')
     with open(os.path.join(run_dir, PARAMSETS_FILE_NAME), 'wb') as outfile:
         outfile.write(paramsets_xml)
@@ -333,31 +586,76 @@ def queue():
             value_c = paramset_values_chosen[key]
             if set(value_d) != set(value_c):
                 outfile.write(key + ': ' + ', '.join(value_c) + '\n')
-    # Generate jobscript
-    with open(os.path.join(run_dir, 'jobscript.sh'), 'w') as outfile:
-        outfile.write('#!/bin/bash\n')
-        outfile.write('#SBATCH --job-name=omd_sim\n')
-        if do_alerts:
-            outfile.write('#SBATCH --mail-type=ALL\n')
-            outfile.write('#SBATCH --mail-user=' + email + '\n')
-        if partition_name != '':
-            outfile.write('#SBATCH --partition=' + partition_name + '\n')
-        outfile.write('#SBATCH --cpus-per-task=8\n')
-        outfile.write('#SBATCH --mem=4gb\n')
-        outfile.write('#SBATCH --time=' + run_time_str + '\n')
-        outfile.write('#SBATCH --output=./output_std/omds%j.log\n')
-        outfile.write('#SBATCH --error=./output_std/omds%j.err\n')
-        outfile.write('#SBATCH --account=biol-stdbom-2019\n')
-        outfile.write('#SBATCH --array=0-' + str(instances_per_paramset-1) + '\n')
-        outfile.write('module load lang/Java/1.8.0_212\n')
-        outfile.write('export MALLOC_ARENA_MAX=8\n')
-        outfile.write('vmArgs="-Xmx1G -XX:ParallelGCThreads=1 -jar"\n')
-        outfile.write('java $vmArgs ./' + latest_binary + ' ' + PARAMSETS_FILE_NAME + ' ./output_files $PSET_ID $SLURM_ARRAY_TASK_ID')
+    # Optionally store plot settings now, so the job-set can be analysed without supervision
+    # (tuning sweeps are only tabulated, so have no use for either)
+    do_analysis_job = False
+    if tuning_paramset_id is None:
+        print('Enter plot settings now? (used when the job-set is analysed automatically)')
+        if input('> ').strip().upper() in [ 'Y', 'YES' ]:
+            save_plot_settings(run_dir, prompt_plot_settings(list(range(num_paramsets)), load_discrepancies(run_dir)))
+        else:
+            print()
+        print('Submit an analysis job to run on a compute node once the job-set finishes?')
+        do_analysis_job = input('> ').strip().upper() in ['Y', 'YES']
+        print()
+    # Generate jobscripts, one per configuration for a tuning sweep
+    if tuning_paramset_id is None:
+        jobscript_names = [ 'jobscript.sh' ] * num_paramsets
+        write_jobscript(os.path.join(run_dir, 'jobscript.sh'), jvm_profiles[0], latest_binary, run_time_str, instances_per_paramset, email if do_alerts else None)
+    else:
+        jobscript_names = [ 'jobscript_' + str(x) + '.sh' for x in range(num_paramsets) ]
+        for jobscript_name, jvm_profile in zip(jobscript_names, jvm_profiles):
+            write_jobscript(os.path.join(run_dir, jobscript_name), jvm_profile, latest_binary, run_time_str, instances_per_paramset, email if do_alerts else None)
+    # Generate analysis jobscript (its logs are kept out of output_std, where every .log is taken to be an instance's)
+    if do_analysis_job:
+        with open(os.path.join(run_dir, 'analysis_jobscript.sh'), 'w') as outfile:
+            outfile.write('#!/bin/bash\n')
+            outfile.write('#SBATCH --job-name=omd_analysis\n')
+            if do_alerts:
+                outfile.write('#SBATCH --mail-type=END,FAIL\n')
+                outfile.write('#SBATCH --mail-user=' + email + '\n')
+            outfile.write('#SBATCH --cpus-per-task=' + str(ANALYSIS_CPUS) + '\n')
+            outfile.write('#SBATCH --mem=' + ANALYSIS_MEMORY + '\n')
+            outfile.write('#SBATCH --time=' + ANALYSIS_TIME_LIMIT + '\n')
+            outfile.write('#SBATCH --output=./analysis%j.log\n')
+            outfile.write('#SBATCH --error=./analysis%j.err\n')
+            outfile.write('#SBATCH --account=biol-stdbom-2019\n')
+            outfile.write('module load ' + PYTHON_MODULE + '\n')
+            outfile.write('export MPLBACKEND=Agg\n')
+            outfile.write('cd "' + os.getcwd() + '"\n')
+            outfile.write('python "' + os.path.abspath(__file__) + '" --analyse ' + run_name)
+    # Choose a partition for each job group
+    if len(partition_names) == 1:
+        job_group_partitions = partition_names * num_paramsets
+    else:
+        partition_loads = query_partition_loads(partition_names)
+        job_group_partitions = None
+        if partition_loads is not None and tuning_paramset_id is None:
+            job_group_partitions = plan_partitions(partition_loads, num_paramsets, instances_per_paramset * max(x['cpus_per_task'] for x in jvm_profiles), instance_time_limit)
+        elif partition_loads is not None:
+            # Every configuration of a tuning sweep runs on one partition, so they are all measured on the same hardware
+            tuning_partitions = plan_partitions(partition_loads, 1, instances_per_paramset * sum(x['cpus_per_task'] for x in jvm_profiles), instance_time_limit)
+            if tuning_partitions is not None:
+                job_group_partitions = tuning_partitions * num_paramsets
+        if job_group_partitions is None:
+            job_group_partitions = prompt_fallback_partition(partition_names, num_paramsets)
+            if job_group_partitions is False:
+                shutil.rmtree(run_dir)
+                return
+        else:
+            rows = [ [ 'Partition', 'Idle CPUs', 'Total CPUs', 'Pending', 'Job Groups' ] ]
+            for partition_name in partition_names:
+                load = partition_loads[partition_name]
+                rows.append([ partition_name, load['cpus_idle'], load['cpus_total'], load['cpus_pending'], job_group_partitions.count(partition_name) ])
+            print_table(rows, (15, 12))
     # Generate launcher script
     with open(os.path.join(run_dir, 'launcher.sh'), 'w') as outfile:
         outfile.write('cd "${0%/*}"\n') # Sets working directory to script directory
         for paramset_id in range(num_paramsets):
-            outfile.write('sbatch --export=PSET_ID=' + str(paramset_id) + ' jobscript.sh\n')
+            if job_group_partitions is None:
+                outfile.write('sbatch --export=PSET_ID=' + str(paramset_id) + ' ' + jobscript_names[paramset_id] + '\n')
+            else:
+                outfile.write('sbatch --partition=' + job_group_partitions[paramset_id] + ' --export=PSET_ID=' + str(paramset_id) + ' ' + jobscript_names[paramset_id] + '\n')
     # Launch the tasks
     print('Ready to launch.')
     input('> ')
@@ -369,12 +667,32 @@ def queue():
     if len(job_group_ids) > 0:
         root = ET.Element('JobSet')
         job_groups = ET.SubElement(root, 'JobGroups')
-        for job_group_id in job_group_ids:
-            ET.SubElement(job_groups, 'JobGroup', id=str(job_group_id))
+        for i, job_group_id in enumerate(job_group_ids):
+            if job_group_partitions is None:
+                ET.SubElement(job_groups, 'JobGroup', id=str(job_group_id))
+            else:
+                ET.SubElement(job_groups, 'JobGroup', id=str(job_group_id), partition=job_group_partitions[i])
         ET.SubElement(root, 'Parameter', name='ParamsetTitle', value=paramsets_file_name[:-4])
         ET.SubElement(root, 'Parameter', name='InstancesPerParamset', value=str(instances_per_paramset))
         ET.SubElement(root, 'Parameter', name='RunsPerInstance', value=str(runs_per_instance))
         ET.SubElement(root, 'Parameter', name='InstanceTimeLimit', value=str(instance_time_limit))
+        if tuning_paramset_id is not None:
+            ET.SubElement(root, 'Parameter', name='Mode', value=MODE_TUNING)
+        job_group_jvm_profiles = ET.SubElement(root, 'JvmProfiles')
+        for jvm_profile in jvm_profiles:
+            ET.SubElement(job_group_jvm_profiles, 'JvmProfile', jvm_profile_attributes(jvm_profile))
+        # Submit the analysis job, to start once every instance has ended for whatever reason
+        if do_analysis_job:
+            dependency = 'afterany:' + ':'.join(str(x) for x in job_group_ids)
+            analysis_partition_args = [ ] if job_group_partitions is None else [ '--partition=' + job_group_partitions[0] ]
+            p = subprocess.Popen([ 'sbatch', '--dependency=' + dependency ] + analysis_partition_args + [ 'analysis_jobscript.sh' ], cwd=run_dir, stdout=subprocess.PIPE)
+            stdout, stderr = p.communicate()
+            analysis_job_ids = [ int(x.strip()) for x in stdout.decode().split('Submitted batch job ') if len(x) > 0 ]
+            if len(analysis_job_ids) > 0:
+                ET.SubElement(root, 'AnalysisJob', id=str(analysis_job_ids[0]))
+            else:
+                print('WARNING: The analysis job could not be submitted; the job-set will need to be analysed manually.')
+                print()
         tree = ET.ElementTree(root)
         tree.write(os.path.join(run_dir, JOB_SET_INFO_FILE_NAME))
         input('Done. Press any key to continue.')
@@ -404,97 +722,301 @@ def monitor():
             return
     choice_index = int(choice)-1
     job_set_name = running_job_set_names[choice_index]
-    job_set = JOB_SETS[job_set_name]
-    jobs = job_set['jobs']
+    view = { 'detailed' : None, 'page' : 0, 'state_filter' : None, 'sort' : 0 }
+    summary = None
     while True:
+        # Re-fetch on every pass, as refreshing replaces the job-set
+        job_set = JOB_SETS[job_set_name]
+        if summary is None or summary['job_set'] is not job_set:
+            summary = summarise_job_set(job_set)
+        if view['detailed'] is None:
+            view['detailed'] = len(job_set['jobs']) <= MONITOR_DETAIL_MAX_CELLS
         clear_screen()
         title('MONITOR')
-        num_paramsets = max(x['paramset_id'] for x in jobs.values())+1
-        num_instances = max(x['instance_id'] for x in jobs.values())+1
-        paramset_ids = list(range(num_paramsets))
-        instance_ids = list(range(num_instances))
-        state_matrix = [ [ None for _ in paramset_ids ] for _ in instance_ids ]
-        runs_matrix = [ [ None for _ in paramset_ids ] for _ in instance_ids ]
-        paramset_runs_completed = [ 0 for _ in paramset_ids ]
-        paramset_runs_target = [ 0 for _ in paramset_ids ]
-        paramset_hours_elapsed = [ 0 for _ in paramset_ids ]
-        paramset_hours_limit = [ 0 for _ in paramset_ids ]
-        for job in jobs.values():
-            state_matrix[job['instance_id']][job['paramset_id']] = job['state'][0]
-            runs_matrix[job['instance_id']][job['paramset_id']] = job['runs_completed']
-            paramset_runs_completed[job['paramset_id']] += job['runs_completed']
-            paramset_runs_target[job['paramset_id']] += job_set['runs_per_instance']
-            paramset_hours_elapsed[job['paramset_id']] += job['time_elapsed'] / 3600
-            paramset_hours_limit[job['paramset_id']] += job_set['instance_time_limit'] / 3600
-        paramset_hours_remaining = [ ]
-        paramset_hours_projected = [ ]
-        paramset_on_track = [ ]
-        for runs_completed, runs_target, hours_elapsed, hours_limit in zip(paramset_runs_completed, paramset_runs_target, paramset_hours_elapsed, paramset_hours_limit):
-            hours_remaining = hours_limit - hours_elapsed
-            paramset_hours_remaining.append(hours_remaining)
-            if hours_elapsed == 0 or runs_completed == 0:
-                hours_projected = 'N/A'
-                on_track = 'N/A'
-            else:
-                hours_projected = hours_elapsed * (runs_target/runs_completed-1) 
-                on_track = hours_projected <= hours_remaining
-            paramset_hours_projected.append(hours_projected)
-            paramset_on_track.append(on_track)
-        rows = [ ]
-        rows.append([ '' ] + [ 'PS' + str(paramset_id) for paramset_id in paramset_ids ])
-        rows.append([ 'Instance ID' ])
-        for instance_id, states, runs in zip(instance_ids, state_matrix, runs_matrix):
-            rows.append([ instance_id ] + [ s + ':' + str(r) for s, r in zip(states, runs) ])
-        rows.append([ ])
-        rows.append([ 'Runs Total' ] + paramset_runs_target)
-        rows.append([ 'Hours Total' ] + [ round(x, 1) for x in paramset_hours_limit ])
-        rows.append([ ])
-        rows.append([ 'Runs Complete' ] + paramset_runs_completed)
-        rows.append([ 'Hours Elapsed' ] + [ round(x, 1) for x in paramset_hours_elapsed ])
-        rows.append([ 'Hours Projected' ] + [ round(x, 1) if type(x) == float else x for x in paramset_hours_projected ])
-        rows.append([ 'Hours Remaining' ] + [ round(x, 1) for x in paramset_hours_remaining ])
-        rows.append([ ])
-        rows.append([ 'On Track?' ] + paramset_on_track)
-        print_table(rows, (15,8))
+        if view['detailed']:
+            print_monitor_detail(summary)
+        else:
+            print_monitor_summary(summary, view)
         print('R) Refresh page')
+        print('S) Sample live resource usage')
+        if view['detailed']:
+            print('V) Switch to summary view')
+        else:
+            print('V) Switch to detailed view')
+            print('N) Next page')
+            print('P) Previous page')
+            print('F) Filter by instance state')
+            print('O) Change sort order')
         print('M) Back to main menu')
         while True:
             choice = input('> ').strip().upper()
             if choice == 'R':
                 update_job_set_data()
                 break
+            if choice == 'S':
+                resource_usage(job_set)
+                break
+            if choice == 'V':
+                view['detailed'] = not view['detailed']
+                break
+            if choice == 'N' and not view['detailed']:
+                view['page'] += 1
+                break
+            if choice == 'P' and not view['detailed']:
+                view['page'] = max(view['page']-1, 0)
+                break
+            if choice == 'F' and not view['detailed']:
+                view['state_filter'] = prompt_state_filter()
+                view['page'] = 0
+                break
+            if choice == 'O' and not view['detailed']:
+                view['sort'] = (view['sort']+1) % len(MONITOR_SORTS)
+                view['page'] = 0
+                break
             if choice == 'M':
                 return
 
 
-def analyse():
-    clear_screen()
-    title('ANALYSE')
-    print('Choose a job-set:')
-    finished_job_set_names = [ ]
-    for job_set_name, job_set in JOB_SETS.items():
-        if job_set['classification'] in (CLF_PENDING, CLF_FINISHED):
-            finished_job_set_names.append(job_set_name)
-    finished_job_set_names.sort()
-    for i, job_set_name in enumerate(finished_job_set_names):
-        job_set_title = str(JOB_SETS[job_set_name]['paramset_title'])
-        print(str(i+1) + ')', job_set_name, '(' + job_set_title + ')')
-    print('M) Back to main menu')
-    choice = None
-    options = set(str(x+1) for x in range(len(finished_job_set_names)))
-    while choice not in options:
+def summarise_job_set(job_set):
+    # Gathers instance states and progress into (paramset, instance) matrices, then aggregates each parameter set
+    jobs = list(job_set['jobs'].values())
+    num_jobs = len(jobs)
+    state_codes = { state : code for code, state in enumerate(MONITOR_STATES) }
+    unknown_code = len(MONITOR_STATES)
+    paramset_ids = np.fromiter((x['paramset_id'] for x in jobs), dtype=np.int64, count=num_jobs)
+    instance_ids = np.fromiter((x['instance_id'] for x in jobs), dtype=np.int64, count=num_jobs)
+    num_paramsets = int(paramset_ids.max())+1
+    num_instances = int(instance_ids.max())+1
+    state_matrix = np.full((num_paramsets, num_instances), unknown_code, dtype=np.int8)
+    runs_matrix = np.zeros((num_paramsets, num_instances), dtype=np.int64)
+    hours_matrix = np.zeros((num_paramsets, num_instances))
+    state_matrix[paramset_ids, instance_ids] = np.fromiter((state_codes.get(x['state'], unknown_code) for x in jobs), dtype=np.int8, count=num_jobs)
+    runs_matrix[paramset_ids, instance_ids] = np.fromiter((x['runs_completed'] or 0 for x in jobs), dtype=np.int64, count=num_jobs)
+    hours_matrix[paramset_ids, instance_ids] = np.fromiter((x['time_elapsed'] for x in jobs), dtype=np.float64, count=num_jobs) / 3600
+    partitions = [ 'N/A' for _ in range(num_paramsets) ]
+    for job in jobs:
+        if job['partition'] is not None:
+            partitions[job['paramset_id']] = job['partition']
+    # Count the instances of each parameter set in each state
+    num_states = len(MONITOR_STATE_LABELS)
+    offset_codes = state_matrix.astype(np.int64) + (np.arange(num_paramsets) * num_states)[:, None]
+    state_counts = np.bincount(offset_codes.ravel(), minlength=num_paramsets*num_states).reshape(num_paramsets, num_states)
+    failed_codes = [ state_codes[x] for x in MONITOR_FAILED_STATES ]
+    runs_completed = runs_matrix.sum(axis=1)
+    runs_target = np.full(num_paramsets, num_instances * job_set['runs_per_instance'])
+    hours_elapsed = hours_matrix.sum(axis=1)
+    hours_limit = np.full(num_paramsets, num_instances * job_set['instance_time_limit'] / 3600)
+    hours_remaining = hours_limit - hours_elapsed
+    # Projections are only possible once a parameter set has both run for a while and completed a run
+    started = (runs_completed > 0) & (hours_elapsed > 0)
+    hours_projected = np.full(num_paramsets, np.nan)
+    hours_projected[started] = hours_elapsed[started] * (runs_target[started] / runs_completed[started] - 1)
+    return { 'job_set' : job_set,
+             'num_paramsets' : num_paramsets,
+             'num_instances' : num_instances,
+             'state_matrix' : state_matrix,
+             'runs_matrix' : runs_matrix,
+             'partitions' : partitions,
+             'state_counts' : state_counts,
+             'num_failed' : state_counts[:, failed_codes].sum(axis=1),
+             'runs_percentiles' : np.percentile(runs_matrix, MONITOR_PERCENTILES, axis=1),
+             'runs_completed' : runs_completed,
+             'runs_target' : runs_target,
+             'progress' : runs_completed / np.maximum(runs_target, 1),
+             'hours_elapsed' : hours_elapsed,
+             'hours_limit' : hours_limit,
+             'hours_remaining' : hours_remaining,
+             'hours_projected' : hours_projected,
+             'started' : started,
+             'on_track' : started & (hours_projected <= hours_remaining) }
+
+
+def format_hours(hours):
+    if np.isnan(hours):
+        return 'N/A'
+    return round(float(hours), 1)
+
+
+def format_on_track(summary, paramset_id):
+    if not summary['started'][paramset_id]:
+        return 'N/A'
+    return bool(summary['on_track'][paramset_id])
+
+
+def print_monitor_detail(summary):
+    # One row per instance and one column per parameter set
+    paramset_ids = list(range(summary['num_paramsets']))
+    rows = [ ]
+    rows.append([ '' ] + [ 'PS' + str(paramset_id) for paramset_id in paramset_ids ])
+    rows.append([ 'Partition' ] + summary['partitions'])
+    rows.append([ 'Instance ID' ])
+    for instance_id in range(summary['num_instances']):
+        states = summary['state_matrix'][:, instance_id]
+        runs = summary['runs_matrix'][:, instance_id]
+        rows.append([ instance_id ] + [ MONITOR_STATE_LABELS[s] + ':' + str(r) for s, r in zip(states, runs) ])
+    rows.append([ ])
+    rows.append([ 'Runs Total' ] + summary['runs_target'].tolist())
+    rows.append([ 'Hours Total' ] + [ format_hours(x) for x in summary['hours_limit'] ])
+    rows.append([ ])
+    rows.append([ 'Runs Complete' ] + summary['runs_completed'].tolist())
+    rows.append([ 'Hours Elapsed' ] + [ format_hours(x) for x in summary['hours_elapsed'] ])
+    rows.append([ 'Hours Projected' ] + [ format_hours(x) for x in summary['hours_projected'] ])
+    rows.append([ 'Hours Remaining' ] + [ format_hours(x) for x in summary['hours_remaining'] ])
+    rows.append([ ])
+    rows.append([ 'On Track?' ] + [ format_on_track(summary, x) for x in paramset_ids ])
+    print_table(rows, (15,8))
+
+
+def print_monitor_summary(summary, view):
+    # One row per parameter set, paged, with the overall picture and the worst parameter sets above
+    state_totals = summary['state_counts'].sum(axis=0)
+    shown_states = [ code for code, total in enumerate(state_totals) if total > 0 ]
+    print('Parameter sets:', summary['num_paramsets'], '  Instances:', summary['num_paramsets'] * summary['num_instances'])
+    print('Instance states:', '  '.join(MONITOR_STATE_LABELS[x] + ' ' + str(state_totals[x]) for x in shown_states))
+    runs_completed = int(summary['runs_completed'].sum())
+    runs_target = int(summary['runs_target'].sum())
+    print('Runs complete:', str(runs_completed) + '/' + str(runs_target), '(' + str(round(100 * runs_completed / max(runs_target, 1), 1)) + '%)')
+    num_on_track = int(summary['on_track'].sum())
+    num_started = int(summary['started'].sum())
+    print('On track:', num_on_track, '  Off track:', num_started - num_on_track, '  Not yet projected:', summary['num_paramsets'] - num_started)
+    unfinished = np.flatnonzero(summary['runs_completed'] < summary['runs_target'])
+    slowest = unfinished[np.argsort(summary['progress'][unfinished], kind='mergesort')][:MONITOR_TOP_N]
+    print('Slowest:', ', '.join('PS' + str(x) + ' (' + str(round(100 * summary['progress'][x], 1)) + '%)' for x in slowest) or 'None')
+    failing = np.flatnonzero(summary['num_failed'] > 0)
+    most_failed = failing[np.argsort(-summary['num_failed'][failing], kind='mergesort')][:MONITOR_TOP_N]
+    print('Most failed:', ', '.join('PS' + str(x) + ' (' + str(summary['num_failed'][x]) + ')' for x in most_failed) or 'None')
+    print()
+    # Select, order and page the parameter sets
+    paramset_ids = np.arange(summary['num_paramsets'])
+    if view['state_filter'] is not None:
+        paramset_ids = paramset_ids[summary['state_counts'][:, view['state_filter']] > 0]
+    sort = MONITOR_SORTS[view['sort']]
+    if sort == 'Slowest':
+        paramset_ids = paramset_ids[np.argsort(summary['progress'][paramset_ids], kind='mergesort')]
+    elif sort == 'Most failed':
+        paramset_ids = paramset_ids[np.argsort(-summary['num_failed'][paramset_ids], kind='mergesort')]
+    num_pages = max(math.ceil(len(paramset_ids) / MONITOR_PAGE_SIZE), 1)
+    view['page'] = min(view['page'], num_pages-1)
+    page_paramset_ids = paramset_ids[view['page']*MONITOR_PAGE_SIZE:(view['page']+1)*MONITOR_PAGE_SIZE]
+    rows = [ ]
+    rows.append([ '', 'Partition' ] + [ MONITOR_STATE_LABELS[x] for x in shown_states ] + [ 'P' + str(x) for x in MONITOR_PERCENTILES ] + [ 'Done %', 'Hrs Used', 'Hrs Proj', 'Hrs Left', 'On Track' ])
+    for paramset_id in page_paramset_ids:
+        row = [ 'PS' + str(paramset_id), summary['partitions'][paramset_id] ]
+        row += summary['state_counts'][paramset_id, shown_states].tolist()
+        row += [ round(float(x), 1) for x in summary['runs_percentiles'][:, paramset_id] ]
+        row += [ round(100 * float(summary['progress'][paramset_id]), 1),
+                 format_hours(summary['hours_elapsed'][paramset_id]),
+                 format_hours(summary['hours_projected'][paramset_id]),
+                 format_hours(summary['hours_remaining'][paramset_id]),
+                 format_on_track(summary, paramset_id) ]
+        rows.append(row)
+    print_table(rows, (8,9))
+    state_filter = 'All' if view['state_filter'] is None else MONITOR_STATES[view['state_filter']] if view['state_filter'] < len(MONITOR_STATES) else 'Unknown'
+    print('Page', view['page']+1, 'of', str(num_pages) + '  (' + str(len(paramset_ids)), 'parameter sets, filter:', state_filter + ', sort:', sort + ')')
+    print()
+
+
+def prompt_state_filter():
+    # Returns the state code to filter on, or None to show all parameter sets
+    print('Show parameter sets with at least one instance in state (e.g. RUNNING or R, blank for all):')
+    while True:
         choice = input('> ').strip().upper()
-        if choice == 'M':
-            return
-    choice_index = int(choice)-1
-    job_set_name = finished_job_set_names[choice_index]
-    job_set = JOB_SETS[job_set_name]
-    jobs = job_set['jobs']
-    num_paramsets = job_set['num_paramsets']
-    run_dir = os.path.join(SIMULATIONS_DIR, job_set_name)
+        if len(choice) == 0:
+            return None
+        if choice in MONITOR_STATES:
+            return MONITOR_STATES.index(choice)
+        if choice in MONITOR_STATE_LABELS:
+            return MONITOR_STATE_LABELS.index(choice)
+
+
+def resource_usage(job_set):
+    while True:
+        clear_screen()
+        title('RESOURCE USAGE')
+        print('Sampling running instances...')
+        print()
+        heap_mbs = [ resource_sampler.parse_memory(x['heap']) for x in job_set['jvm_profiles'] ]
+        samples = resource_sampler.sample_job_set(job_set['jobs'], heap_mbs)
+        if len(samples) == 0:
+            print('No instances are currently running.')
+            print()
+        else:
+            rows = [ ]
+            rows.append([ 'Job ID', 'PS', 'Instance', 'Node', 'CPUs', 'CPUs Used', 'CPU %', 'Peak RSS (MB)', 'Flags' ])
+            for job_id in sorted(samples.keys(), key=lambda x: (job_set['jobs'][x]['paramset_id'], job_set['jobs'][x]['instance_id'])):
+                job, sample = job_set['jobs'][job_id], samples[job_id]
+                rows.append([ job_id,
+                              job['paramset_id'],
+                              job['instance_id'],
+                              sample['node'] if sample['node'] is not None else 'N/A',
+                              sample['cpus'] if sample['cpus'] is not None else 'N/A',
+                              round(sample['cpus_used'], 1) if sample['cpus_used'] is not None else 'N/A',
+                              round(sample['cpu_utilisation'] * 100) if sample['cpu_utilisation'] is not None else 'N/A',
+                              round(sample['rss_mb']) if sample['rss_mb'] is not None else 'N/A',
+                              ','.join(sample['flags']) ])
+            print_table(rows, (15, 5, 10, 12, 6, 11, 7, 15, 18))
+            num_low_cpu = sum(1 for x in samples.values() if resource_sampler.FLAG_LOW_CPU in x['flags'])
+            num_peak_rss = sum(1 for x in samples.values() if resource_sampler.FLAG_PEAK_RSS in x['flags'])
+            print(num_low_cpu, 'instance(s) flagged', resource_sampler.FLAG_LOW_CPU, '(under ' + str(round(resource_sampler.LOW_CPU_FRACTION * 100)) + '% of allocated CPUs used; check CPU_THREADS)')
+            print(num_peak_rss, 'instance(s) flagged', resource_sampler.FLAG_PEAK_RSS, '(peak RSS since start over ' + str(round(resource_sampler.PEAK_RSS_FRACTION * 100)) + '% of the JVM heap plus ' + str(resource_sampler.NON_HEAP_ALLOWANCE_MB) + ' MB non-heap allowance;')
+            print('  the heap has been near its limit at some point, consider a larger -Xmx if this persists)')
+            print()
+        print('R) Resample')
+        print('B) Back to monitor')
+        while True:
+            choice = input('> ').strip().upper()
+            if choice == 'R':
+                break
+            if choice == 'B':
+                return
+
+
+def parse_output_file(filepath):
+    # Returns None if the file does not contain a full set of results
+    root = ET.parse(filepath).getroot()
+    file_results = { 'n' : 0,
+                     'result_msds' : { },
+                     'result_stds' : { },
+                     'timing_mean' : None,
+                     'timing_std' : None }
+    # Load results
+    try:
+        for res in root.find('RESULTS').findall('RES'):
+            timepoint = float(res.get('T'))
+            msd = float(res.get('MSD'))
+            std = float(res.get('STD'))
+            num = int(float(res.get('NUM')))
+            file_results['n'] = num
+            file_results['result_msds'][timepoint] = msd
+            file_results['result_stds'][timepoint] = std
+    except:
+        return None
+    # Load time stats
+    try:
+        stats = root.find('STATISTICS').findall('STAT')
+        for stat in stats:
+            stat_name = next(value for key, value in stat.items() if key == 'NAME')
+            stat_value = next(value for key, value in stat.items() if key == 'VALUE')
+            if stat_name == 'MEAN_SIMULATION_DURATION':
+                file_results['timing_mean'] = float(stat_value)
+            elif stat_name == 'STD_SIMULATION_DURATION':
+                file_results['timing_std'] = float(stat_value)
+    except:
+        return None
+    return file_results
+
+
+def aggregate_results(run_dir, num_paramsets, num_processes=1):
     # Get relevant output files
     all_output_files = sorted(os.listdir(os.path.join(run_dir, OUTPUT_DIR_NAME)))
     xml_output_files = [ x for x in all_output_files if x[-4:] == '.xml' ]
+    xml_output_paths = [ os.path.join(run_dir, OUTPUT_DIR_NAME, x) for x in xml_output_files ]
+    # Parse them, spreading the work over several processes if there are cores to spare
+    if num_processes > 1 and len(xml_output_paths) > 1:
+        with multiprocessing.Pool(num_processes) as pool:
+            output_file_results = dict(zip(xml_output_files, pool.map(parse_output_file, xml_output_paths)))
+    else:
+        output_file_results = dict(zip(xml_output_files, map(parse_output_file, xml_output_paths)))
     incomplete_file_names = set()
     results = { }
     for paramset_id in range(num_paramsets):
@@ -508,37 +1030,8 @@ def analyse():
         # Get data from all available output files for each parameter set
         paramset_output_files = [ x for x in xml_output_files if ('paramset-' + str(paramset_id) + '_') in x ]
         for filename in paramset_output_files:
-            filepath = os.path.join(run_dir, OUTPUT_DIR_NAME, filename)
-            root = ET.parse(filepath).getroot()
-            file_results = { 'n' : 0,
-                             'result_msds' : { },
-                             'result_stds' : { },
-                             'timing_mean' : None,
-                             'timing_std' : None }
-            # Load results
-            try:
-                for res in root.find('RESULTS').findall('RES'):
-                    timepoint = float(res.get('T'))
-                    msd = float(res.get('MSD'))
-                    std = float(res.get('STD'))
-                    num = int(float(res.get('NUM')))
-                    file_results['n'] = num
-                    file_results['result_msds'][timepoint] = msd
-                    file_results['result_stds'][timepoint] = std
-            except:
-                incomplete_file_names.add(filename)
-                continue
-            # Load time stats
-            try:
-                stats = root.find('STATISTICS').findall('STAT')
-                for stat in stats:
-                    stat_name = next(value for key, value in stat.items() if key == 'NAME')
-                    stat_value = next(value for key, value in stat.items() if key == 'VALUE')
-                    if stat_name == 'MEAN_SIMULATION_DURATION':
-                        file_results['timing_mean'] = float(stat_value)
-                    elif stat_name == 'STD_SIMULATION_DURATION':
-                        file_results['timing_std'] = float(stat_value)
-            except:
+            file_results = output_file_results[filename]
+            if file_results is None:
                 incomplete_file_names.add(filename)
                 continue
             paramset_file_results.append(file_results)
@@ -576,50 +1069,239 @@ def analyse():
         paramset_results['lss'] = least_squares_score(list(paramset_results['result_msds'].keys()),
                                                       list(paramset_results['result_msds'].values()))
         results[paramset_id] = paramset_results
-    # Report on the meta-analyses
-    if len(incomplete_file_names) > 0:
-        print('WARNING: Some instances did not complete enough runs to be included in the analyses:')
-        for filename in sorted(incomplete_file_names):
-            print('*', filename)
-    null_paramset_ids = set(range(num_paramsets)) - set(results.keys())
-    if len(null_paramset_ids) == num_paramsets:
-        print()
-        print('ERROR: None of the parameter sets completed any runs; there is nothing to analyse.')
+    return results, incomplete_file_names
+
+
+def apply_trajectory_msds(run_dir, num_paramsets, results, msd_settings, num_processes=1):
+    # Replace the MSDs from the output files with ones recomputed from exported trajectories
+    # Parameter sets that cannot be recomputed with these settings are dropped, so that every score is comparable
+    output_dir = os.path.join(run_dir, OUTPUT_DIR_NAME)
+    trajectory_paths = { }
+    for paramset_id in range(num_paramsets):
+        paths = trajectory_msd.find_trajectory_files(output_dir, paramset_id)
+        if len(paths) > 0:
+            trajectory_paths[paramset_id] = paths
+    msds = trajectory_msd.compute_msds(trajectory_paths, msd_settings['lag_stride'], msd_settings['max_lag'], msd_settings['runs'], num_processes)
+    recomputed_results = { }
+    for paramset_id, paramset_msds in msds.items():
+        if paramset_msds['n'] == 0:
+            continue
+        # Run times only come from the output files, so are unknown for parameter sets without any
+        paramset_results = results.get(paramset_id, { 'timing_mean' : None, 'timing_std' : None })
+        paramset_results['n'] = paramset_msds['n']
+        paramset_results['timepoints'] = paramset_msds['timepoints']
+        paramset_results['result_msds'] = dict(zip(paramset_msds['timepoints'], paramset_msds[msd_settings['msd_kind'] + '_msds']))
+        paramset_results['result_stds'] = dict(zip(paramset_msds['timepoints'], paramset_msds[msd_settings['msd_kind'] + '_stds']))
+        paramset_results['lss'] = least_squares_score(list(paramset_results['result_msds'].keys()),
+                                                      list(paramset_results['result_msds'].values()))
+        recomputed_results[paramset_id] = paramset_results
+    dropped_paramset_ids = sorted(set(results.keys()) - set(recomputed_results.keys()))
+    if len(dropped_paramset_ids) > 0:
+        print('WARNING: MSDs could not be recomputed from trajectories for the following parameter sets (no trajectory files, or none of the chosen runs),')
+        print('so they have been left out of the analyses:', ', '.join(str(x) for x in dropped_paramset_ids))
+    return { x : recomputed_results[x] for x in sorted(recomputed_results.keys()) }
+
+
+def has_trajectories(run_dir, num_paramsets):
+    output_dir = os.path.join(run_dir, OUTPUT_DIR_NAME)
+    return any(len(trajectory_msd.find_trajectory_files(output_dir, x)) > 0 for x in range(num_paramsets))
+
+
+def prompt_msd_settings():
+    print()
+    print('MSD type:')
+    print('1) Ensemble (displacement from starting position, as in the output files)')
+    print('2) Time-averaged (over all pairs of samples separated by each lag)')
+    choice = None
+    while choice not in ('1', '2'):
+        choice = input('> ').strip()
+    msd_kind = [ trajectory_msd.MSD_KIND_ENSEMBLE, trajectory_msd.MSD_KIND_TIME_AVERAGED ][int(choice)-1]
+    print()
+    print('Lag stride in trajectory samples (leave blank for 1)')
+    lag_stride_str = input('> ').strip()
+    print()
+    print('Maximum lag time in seconds (leave blank for no limit)')
+    max_lag_str = input('> ').strip()
+    print()
+    print('Runs to include (comma separated, leave blank for all)')
+    runs_str = input('> ').strip()
+    print()
+    return { 'msd_kind' : msd_kind,
+             'lag_stride' : int(lag_stride_str) if lag_stride_str else 1,
+             'max_lag' : float(max_lag_str) if max_lag_str else None,
+             'runs' : [ int(x) for x in runs_str.split(',') ] if runs_str else None }
+
+
+def save_msd_settings(run_dir, msd_settings):
+    root = ET.Element('MsdSettings')
+    ET.SubElement(root, 'Parameter', name='MsdKind', value=msd_settings['msd_kind'])
+    ET.SubElement(root, 'Parameter', name='LagStride', value=str(msd_settings['lag_stride']))
+    if msd_settings['max_lag'] is not None:
+        ET.SubElement(root, 'Parameter', name='MaxLag', value=str(msd_settings['max_lag']))
+    if msd_settings['runs'] is not None:
+        ET.SubElement(root, 'Parameter', name='Runs', value=','.join(str(x) for x in msd_settings['runs']))
+    tree = ET.ElementTree(root)
+    tree.write(os.path.join(run_dir, MSD_SETTINGS_FILE_NAME))
+
+
+def load_msd_settings(run_dir):
+    # Stored MSD settings mean that MSDs are to be recomputed from exported trajectories
+    msd_settings_path = os.path.join(run_dir, MSD_SETTINGS_FILE_NAME)
+    if not os.path.isfile(msd_settings_path):
+        return None
+    msd_settings = { 'msd_kind' : trajectory_msd.MSD_KIND_ENSEMBLE,
+                     'lag_stride' : 1,
+                     'max_lag' : None,
+                     'runs' : None }
+    root = ET.parse(msd_settings_path).getroot()
+    for element in root:
+        if element.tag == 'Parameter':
+            name, value = element.get('name'), element.get('value')
+            if name == 'MsdKind':
+                msd_settings['msd_kind'] = value
+            if name == 'LagStride':
+                msd_settings['lag_stride'] = int(value)
+            if name == 'MaxLag':
+                msd_settings['max_lag'] = float(value)
+            if name == 'Runs':
+                msd_settings['runs'] = [ int(x) for x in value.split(',') ]
+    return msd_settings
+
+
+def aggregate_tuning_results(job_set, results):
+    jobs = job_set['jobs']
+    # Get CPU and memory accounting for each instance; MaxRSS is only reported for job steps
+    job_group_ids_str = ','.join(str(x) for x in sorted(set(job['job_group_id'] for job in jobs.values())))
+    p = subprocess.Popen([ 'sacct', '-j', job_group_ids_str, '-o', 'JobID,AllocCPUS,ElapsedRaw,TotalCPU,MaxRSS', '-P', '--noheader' ], stdout=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+    usage = { } # Keyed by job ID
+    for line in stdout.decode().split('\n'):
+        if line.count('|') != 4:
+            continue
+        job_step_id, alloc_cpus_str, time_elapsed_str, total_cpu_str, max_rss_str = line.strip().split('|')
+        job_id = job_step_id.split('.')[0]
+        if job_id not in jobs:
+            continue
+        if job_id not in usage:
+            usage[job_id] = { 'core_hours' : 0, 'cpu_hours' : 0, 'max_rss_mb' : 0 }
+        if job_step_id == job_id:
+            usage[job_id]['core_hours'] = int(alloc_cpus_str) * int(time_elapsed_str) / 3600
+            usage[job_id]['cpu_hours'] = (resource_sampler.parse_duration(total_cpu_str) or 0) / 3600
+        else:
+            usage[job_id]['max_rss_mb'] = max(usage[job_id]['max_rss_mb'], resource_sampler.parse_memory(max_rss_str) or 0)
+    # Combine the instances of each configuration
+    tuning_results = { }
+    for paramset_id, jvm_profile in enumerate(job_set['jvm_profiles']):
+        paramset_job_ids = [ job_id for job_id, job in jobs.items() if job['paramset_id'] == paramset_id ]
+        runs = sum(jobs[x]['runs_completed'] for x in paramset_job_ids)
+        if paramset_id in results:
+            runs = max(runs, results[paramset_id]['n'])
+        core_hours = sum(usage[x]['core_hours'] for x in paramset_job_ids if x in usage)
+        cpu_hours = sum(usage[x]['cpu_hours'] for x in paramset_job_ids if x in usage)
+        tuning_results[paramset_id] = { 'jvm_profile' : jvm_profile,
+                                        'runs' : runs,
+                                        'core_hours' : core_hours,
+                                        'runs_per_core_hour' : runs / core_hours if core_hours > 0 else 0,
+                                        'cpu_efficiency' : cpu_hours / core_hours if core_hours > 0 else None,
+                                        'max_rss_mb' : max([ usage[x]['max_rss_mb'] for x in paramset_job_ids if x in usage ] + [ 0 ]),
+                                        'timing_mean' : results[paramset_id]['timing_mean'] if paramset_id in results else None }
+    return tuning_results
+
+
+def best_tuning_result(tuning_results):
+    completed = [ x for x in tuning_results.values() if x['runs'] > 0 and x['core_hours'] > 0 ]
+    if len(completed) == 0:
+        return None
+    return max(completed, key=lambda x: x['runs_per_core_hour'])
+
+
+def write_tuning_results(results_dir, tuning_results):
+    with open(os.path.join(results_dir, 'Tuning.csv'), 'w') as outfile:
+        outfile.write('Parameter Set,' + ','.join(JVM_PROFILE_ATTRIBUTES.values()) + ',Runs,Core Hours,Runs per Core Hour,CPU Efficiency,Max RSS (MB),Run Time Mean (s)\n')
+        for paramset_id, tuning_result in tuning_results.items():
+            line_values = [ str(paramset_id) ]
+            line_values += [ str(tuning_result['jvm_profile'][x]) for x in JVM_PROFILE_ATTRIBUTES.keys() ]
+            line_values += [ str(tuning_result['runs']),
+                             str(round(tuning_result['core_hours'], 3)),
+                             str(round(tuning_result['runs_per_core_hour'], 3)),
+                             str(round(tuning_result['cpu_efficiency'], 3)) if tuning_result['cpu_efficiency'] is not None else '-',
+                             str(round(tuning_result['max_rss_mb'])),
+                             str(round(tuning_result['timing_mean'], 3)) if tuning_result['timing_mean'] is not None else '-' ]
+            outfile.write(','.join(line_values) + '\n')
+
+
+def analyse_tuning(job_set_name, job_set):
+    run_dir = os.path.join(SIMULATIONS_DIR, job_set_name)
+    results, incomplete_file_names = aggregate_results(run_dir, job_set['num_paramsets'])
+    tuning_results = aggregate_tuning_results(job_set, results)
+    results_dir = create_results_dir(run_dir)
+    write_tuning_results(results_dir, tuning_results)
+    publish_results_dir(run_dir, results_dir)
+    clear_screen()
+    title('TUNING')
+    rows = [ [ 'PS', 'CPUs', 'Threads', 'Heap', 'GC Thr.', 'Arenas', 'Runs', 'Core Hrs', 'Runs/CH', 'CPU Eff.', 'RSS (MB)' ] ]
+    for paramset_id, tuning_result in tuning_results.items():
+        jvm_profile = tuning_result['jvm_profile']
+        rows.append([ paramset_id,
+                      jvm_profile['cpus_per_task'],
+                      jvm_profile['cpu_threads'],
+                      jvm_profile['heap'],
+                      jvm_profile['parallel_gc_threads'],
+                      jvm_profile['malloc_arena_max'],
+                      tuning_result['runs'],
+                      round(tuning_result['core_hours'], 2),
+                      round(tuning_result['runs_per_core_hour'], 2),
+                      round(tuning_result['cpu_efficiency'], 2) if tuning_result['cpu_efficiency'] is not None else 'N/A',
+                      round(tuning_result['max_rss_mb']) ])
+    print_table(rows, (4, 9))
+    best = best_tuning_result(tuning_results)
+    if best is None:
+        print('ERROR: None of the configurations completed any runs; there is nothing to compare.')
         print()
-        print('Press any key to return to the main menu.')
-        input('> ')
+        input('Press any key to return to the main menu.')
         return
-    elif len(null_paramset_ids) > 0:
-        print()
-        print('WARNING: Some parameter sets did not complete any runs:')
-        for paramset_id in sorted(null_paramset_ids):
-            print('* PS' + str(paramset_id))
+    print('Best configuration (' + str(round(best['runs_per_core_hour'], 2)) + ' runs per core hour):')
+    print(describe_jvm_profile(best['jvm_profile']))
     print()
-    print('The run counts for each parameter set are:')
-    for paramset_id in range(num_paramsets):
-        if paramset_id in results.keys():
-            print('* PS' + str(paramset_id) + ':', results[paramset_id]['n'])
-        else:
-            print('* PS' + str(paramset_id) + ': NONE')
+    print('Current profile for new jobscripts:')
+    print(describe_jvm_profile(load_jvm_profile()))
     print()
-    print('Press any key to continue.')
-    input('> ')
-    # Create the results directory
-    results_dir = os.path.join(run_dir, RESULTS_DIR_NAME)
+    print('Save the best configuration as the profile for new jobscripts?')
+    if input('> ').strip().upper() in [ 'Y', 'YES' ]:
+        save_jvm_profile(best['jvm_profile'])
+        print('Saved to', JVM_PROFILE_PATH)
+    print()
+    input('Done. Press any key to continue.')
+
+
+def create_results_dir(run_dir):
+    # Results are written to a temporary directory and only moved into place by publish_results_dir() once
+    # complete, as a job-set with a RESULTS directory is taken to have been analysed
+    results_dir = os.path.join(run_dir, RESULTS_DIR_NAME + '.' + str(os.getpid()) + '.tmp')
     if os.path.exists(results_dir):
         shutil.rmtree(results_dir)
     os.mkdir(results_dir)
+    return results_dir
+
+
+def publish_results_dir(run_dir, results_dir):
+    final_results_dir = os.path.join(run_dir, RESULTS_DIR_NAME)
+    if os.path.exists(final_results_dir):
+        shutil.rmtree(final_results_dir)
+    os.rename(results_dir, final_results_dir)
+    return final_results_dir
+
+
+def write_results(results_dir, results):
     paramset_ids = list(results.keys())
     timepoints = [ x['timepoints'] for x in results.values() ]
-    result_msds = [ list(x['result_msds'].values()) for x in results.values() ]
-    result_stds = [ list(x['result_stds'].values()) for x in results.values() ]
-    runtime_means = [ x['timing_mean'] for x in results.values() ]
-    runtime_stds = [ x['timing_std'] for x in results.values() ]
     least_squares_scores = [ x['lss'] for x in results.values() ]
     # Write run times to CSV
     with open(os.path.join(results_dir, 'Run Times.csv'), 'w') as outfile:
         outfile.write('Parameter Set,Run Time Mean (s),Run Time S.D. (s)\n')
         for paramset_id, paramset_results in results.items():
+            if paramset_results['timing_mean'] is None:
+                continue # Parameter sets analysed from trajectories alone have no run times
             outfile.write(str(paramset_id) + ',' + str(round(paramset_results['timing_mean'], 9)) + ',' + str(round(paramset_results['timing_std'], 9)) + '\n')
     # Write MSDs to CSV
     with open(os.path.join(results_dir, 'MSDs.csv'), 'w') as outfile:
@@ -647,29 +1329,21 @@ def analyse():
     plt.ylabel('Least Squares Score')
     plt.savefig(os.path.join(results_dir, 'Scores Graph.png'), dpi=600)
     plt.close()
-    # Get graph specifics
-    axis_label = ''
-    axis_values = [ ]
-    axis_value_type = ''
-    do_individual_graphs = False
-    do_linreg = False
-    # Load discrepancies from file
+
+
+def load_discrepancies(run_dir):
     discrepancies = [ ]
-    try:
-        with open(os.path.join(run_dir, DISCREPANCIES_FILE_NAME), 'r') as infile:
-            for line in infile.readlines():
-                line = line.strip()
-                if line:
-                    paramname = line.split(': ')[0]
-                    paramvals = line.split(': ')[1].split(', ')
-                    discrepancies.append((paramname, paramvals))
-    except:
-        print('ERROR: Failed to read', DISCREPANCIES_FILE_NAME)
-        print()
-        print('Press any key to return to the main menu.')
-        input('> ')
-        return
-    # Prompt for graph specifics
+    with open(os.path.join(run_dir, DISCREPANCIES_FILE_NAME), 'r') as infile:
+        for line in infile.readlines():
+            line = line.strip()
+            if line:
+                paramname = line.split(': ')[0]
+                paramvals = line.split(': ')[1].split(', ')
+                discrepancies.append((paramname, paramvals))
+    return discrepancies
+
+
+def prompt_plot_settings(paramset_ids, discrepancies):
     clear_screen()
     if len(discrepancies) > 0:
         print('Discrepancies:')
@@ -691,6 +1365,7 @@ def analyse():
         if len(axis_values) == len(paramset_ids):
             break
         print('Wrong length.')
+    do_linreg = False
     try:
         [ float(x) for x in axis_values ]
         print()
@@ -711,16 +1386,104 @@ def analyse():
     print('Produce individual graphs for each parameter set?')
     do_individual_graphs = input('> ').strip().upper() in [ 'Y', 'YES' ]
     print()
-    print('Analysing results...')
-    print()
+    return { 'axis_label' : axis_label,
+             'axis_values' : dict(zip(paramset_ids, axis_values)),
+             'axis_value_type' : axis_value_type,
+             'do_linreg' : do_linreg,
+             'do_individual_graphs' : do_individual_graphs }
+
+
+def default_plot_settings(num_paramsets, discrepancies):
+    # Label graphs by the parameter that varies between parameter sets if there is exactly one, otherwise by ID
+    plot_settings = { 'axis_label' : 'Parameter Set',
+                      'axis_values' : { x : str(x) for x in range(num_paramsets) },
+                      'axis_value_type' : 'String',
+                      'do_linreg' : False,
+                      'do_individual_graphs' : False }
+    varying = [ mm for mm in discrepancies if len(mm[1]) == num_paramsets and mm[1].count(mm[1][0]) != len(mm[1]) ]
+    if len(varying) == 1:
+        plot_settings['axis_label'] = varying[0][0]
+        plot_settings['axis_values'] = dict(enumerate(varying[0][1]))
+        try:
+            plot_settings['axis_values'] = { k : float(v) for k, v in plot_settings['axis_values'].items() }
+            plot_settings['axis_value_type'] = 'Number'
+        except ValueError:
+            pass
+    return plot_settings
+
+
+def save_plot_settings(run_dir, plot_settings):
+    root = ET.Element('PlotSettings')
+    ET.SubElement(root, 'Parameter', name='AxisLabel', value=plot_settings['axis_label'])
+    ET.SubElement(root, 'Parameter', name='AxisValueType', value=plot_settings['axis_value_type'])
+    ET.SubElement(root, 'Parameter', name='DoLinearRegression', value=str(plot_settings['do_linreg']))
+    ET.SubElement(root, 'Parameter', name='DoIndividualGraphs', value=str(plot_settings['do_individual_graphs']))
+    axis_values = ET.SubElement(root, 'AxisValues')
+    for paramset_id, axis_value in sorted(plot_settings['axis_values'].items()):
+        ET.SubElement(axis_values, 'AxisValue', paramset=str(paramset_id), value=str(axis_value))
+    tree = ET.ElementTree(root)
+    tree.write(os.path.join(run_dir, PLOT_SETTINGS_FILE_NAME))
+
+
+def load_plot_settings(run_dir):
+    plot_settings_path = os.path.join(run_dir, PLOT_SETTINGS_FILE_NAME)
+    if not os.path.isfile(plot_settings_path):
+        return None
+    plot_settings = { 'axis_label' : '',
+                      'axis_values' : { },
+                      'axis_value_type' : 'String',
+                      'do_linreg' : False,
+                      'do_individual_graphs' : False }
+    root = ET.parse(plot_settings_path).getroot()
+    for element in root:
+        if element.tag == 'AxisValues':
+            for axis_value in element:
+                plot_settings['axis_values'][int(axis_value.get('paramset'))] = axis_value.get('value')
+        elif element.tag == 'Parameter':
+            name, value = element.get('name'), element.get('value')
+            if name == 'AxisLabel':
+                plot_settings['axis_label'] = value
+            if name == 'AxisValueType':
+                plot_settings['axis_value_type'] = value
+            if name == 'DoLinearRegression':
+                plot_settings['do_linreg'] = value == 'True'
+            if name == 'DoIndividualGraphs':
+                plot_settings['do_individual_graphs'] = value == 'True'
+    if plot_settings['axis_value_type'] == 'Number':
+        plot_settings['axis_values'] = { k : float(v) for k, v in plot_settings['axis_values'].items() }
+    return plot_settings
+
+
+def plot_results(results_dir, results, plot_settings, num_processes=1):
+    axis_label = plot_settings['axis_label']
+    do_linreg = plot_settings['do_linreg']
+    do_individual_graphs = plot_settings['do_individual_graphs']
+    # Fall back to the parameter set ID for any parameter set without a stored axis value
+    axis_values = [ ]
+    for paramset_id in results.keys():
+        if paramset_id in plot_settings['axis_values']:
+            axis_values.append(plot_settings['axis_values'][paramset_id])
+        elif plot_settings['axis_value_type'] == 'Number':
+            axis_values.append(float(paramset_id))
+        else:
+            axis_values.append(str(paramset_id))
+    timepoints = [ x['timepoints'] for x in results.values() ]
+    result_msds = [ list(x['result_msds'].values()) for x in results.values() ]
+    result_stds = [ list(x['result_stds'].values()) for x in results.values() ]
+    # Only parameter sets with output files have run times
+    timed_results = [ (axis_value, x) for axis_value, x in zip(axis_values, results.values()) if x['timing_mean'] is not None ]
+    runtime_axis_values = [ x[0] for x in timed_results ]
+    runtime_means = [ x[1]['timing_mean'] for x in timed_results ]
+    runtime_stds = [ x[1]['timing_std'] for x in timed_results ]
     # Linear regression fit for run times
+    do_linreg = do_linreg and len(timed_results) > 1
     if do_linreg:
-        slope, intercept, r_value, p_value, std_err = scistats.linregress(axis_values, runtime_means)
+        slope, intercept, r_value, p_value, std_err = scistats.linregress(runtime_axis_values, runtime_means)
     # Plot scatter graph of run times with error bars, with linear regression fit on top
     ax = plt.subplot(111)
-    ax.errorbar(axis_values, runtime_means, yerr=runtime_stds, fmt='o', linestyle='None')
+    ax.errorbar(runtime_axis_values, runtime_means, yerr=runtime_stds, fmt='o', linestyle='None')
     if do_linreg:
-        xs = np.array(axis_values)
+        xs = np.array(runtime_axis_values)
         ys = slope * xs + intercept
         ax.plot(xs, ys, '-r', color='black', label='y = ' + str(round(slope, 1)) + 'x + ' + str(round(intercept, 1)) + ', R2 = ' + str(round(r_value**2, 3)))
         #box = ax.get_position()
@@ -754,26 +1517,344 @@ def analyse():
     if do_individual_graphs:
         if not os.path.isdir(os.path.join(results_dir, INDIVIDUAL_MSDS_DIR_NAME)):
             os.mkdir(os.path.join(results_dir, INDIVIDUAL_MSDS_DIR_NAME))
-        for ps_axis_value, ps_timepoints, ps_result_msds, ps_result_stds, ps_line_colour in zip(axis_values, timepoints, result_msds, result_stds, line_colours):
-            ax = plt.subplot(111)
-            ax.plot(OBS_TIMEPOINTS, OBS_DATAPOINTS, color='black', linewidth=1)
-            try:
-                ax.scatter(OBS_TIMEPOINTS, OBS_DATAPOINTS, color='black', s=3)
-                ax.plot(ps_timepoints, ps_result_msds, linewidth=0.5, label=str(ps_axis_value), color=ps_line_colour)
-                error_lower = [ ps_result_msds[i] - ps_result_stds[i] for i in range(len(ps_result_msds)) ]
-                error_upper = [ ps_result_msds[i] + ps_result_stds[i] for i in range(len(ps_result_msds)) ]
-                ax.fill_between(ps_timepoints, error_lower, error_upper, alpha=0.25, facecolor=ps_line_colour)
-                ax.set_ylim(bottom=0)
-                ax.set_xlim(left=0)
-                plt.xlabel('Time (s)')
-                plt.ylabel('MSD (µm^2)')
-                plt.savefig(os.path.join(results_dir, INDIVIDUAL_MSDS_DIR_NAME, str(ps_axis_value) + '.png'), dpi=600)
-            except Exception as e:
-                pass
-            plt.close()
+        graph_args = [ (results_dir,) + x for x in zip(axis_values, timepoints, result_msds, result_stds, line_colours) ]
+        if num_processes > 1 and len(graph_args) > 1:
+            with multiprocessing.Pool(num_processes) as pool:
+                pool.map(plot_individual_msds, graph_args)
+        else:
+            for x in graph_args:
+                plot_individual_msds(x)
+
+
+def plot_individual_msds(graph_args):
+    results_dir, ps_axis_value, ps_timepoints, ps_result_msds, ps_result_stds, ps_line_colour = graph_args
+    ax = plt.subplot(111)
+    ax.plot(OBS_TIMEPOINTS, OBS_DATAPOINTS, color='black', linewidth=1)
+    try:
+        ax.scatter(OBS_TIMEPOINTS, OBS_DATAPOINTS, color='black', s=3)
+        ax.plot(ps_timepoints, ps_result_msds, linewidth=0.5, label=str(ps_axis_value), color=ps_line_colour)
+        error_lower = [ ps_result_msds[i] - ps_result_stds[i] for i in range(len(ps_result_msds)) ]
+        error_upper = [ ps_result_msds[i] + ps_result_stds[i] for i in range(len(ps_result_msds)) ]
+        ax.fill_between(ps_timepoints, error_lower, error_upper, alpha=0.25, facecolor=ps_line_colour)
+        ax.set_ylim(bottom=0)
+        ax.set_xlim(left=0)
+        plt.xlabel('Time (s)')
+        plt.ylabel('MSD (µm^2)')
+        plt.savefig(os.path.join(results_dir, INDIVIDUAL_MSDS_DIR_NAME, str(ps_axis_value) + '.png'), dpi=600)
+    except Exception as e:
+        pass
+    plt.close()
+
+
+def analysis_job_queued(job_set):
+    if job_set['analysis_job_id'] is None:
+        return False
+    try:
+        p = subprocess.Popen([ 'squeue', '-h', '-j', str(job_set['analysis_job_id']), '-o', '%T' ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        stdout, stderr = p.communicate()
+    except OSError:
+        return False
+    return len(stdout.decode().strip()) > 0
+
+
+def analyse():
+    clear_screen()
+    title('ANALYSE')
+    print('Choose a job-set:')
+    finished_job_set_names = [ ]
+    for job_set_name, job_set in JOB_SETS.items():
+        if job_set['classification'] in (CLF_PENDING, CLF_FINISHED):
+            finished_job_set_names.append(job_set_name)
+    finished_job_set_names.sort()
+    for i, job_set_name in enumerate(finished_job_set_names):
+        job_set_title = str(JOB_SETS[job_set_name]['paramset_title'])
+        print(str(i+1) + ')', job_set_name, '(' + job_set_title + ')')
+    print('M) Back to main menu')
+    choice = None
+    options = set(str(x+1) for x in range(len(finished_job_set_names)))
+    while choice not in options:
+        choice = input('> ').strip().upper()
+        if choice == 'M':
+            return
+    choice_index = int(choice)-1
+    job_set_name = finished_job_set_names[choice_index]
+    job_set = JOB_SETS[job_set_name]
+    # A queued analysis job would replace the results produced here when it runs
+    if analysis_job_queued(job_set):
+        print()
+        print('WARNING: Analysis job', job_set['analysis_job_id'], 'is still queued for this job-set and will overwrite any results produced now.')
+        print('C) Cancel the analysis job and analyse now')
+        print('M) Back to main menu')
+        choice = None
+        while choice != 'C':
+            choice = input('> ').strip().upper()
+            if choice == 'M':
+                return
+        p = subprocess.Popen([ 'scancel', str(job_set['analysis_job_id']) ], stdout=subprocess.PIPE)
+        p.communicate()
+        print()
+    if job_set['mode'] == MODE_TUNING:
+        analyse_tuning(job_set_name, job_set)
+        return
+    num_paramsets = job_set['num_paramsets']
+    run_dir = os.path.join(SIMULATIONS_DIR, job_set_name)
+    results, incomplete_file_names = aggregate_results(run_dir, num_paramsets)
+    # Optionally recompute MSDs from exported trajectories
+    if has_trajectories(run_dir, num_paramsets):
+        print()
+        print('Exported trajectories found. Recompute MSDs from them?')
+        if input('> ').strip().upper() in [ 'Y', 'YES' ]:
+            msd_settings = prompt_msd_settings()
+            save_msd_settings(run_dir, msd_settings)
+            print('Computing MSDs from trajectories...')
+            results = apply_trajectory_msds(run_dir, num_paramsets, results, msd_settings)
+        elif os.path.isfile(os.path.join(run_dir, MSD_SETTINGS_FILE_NAME)):
+            os.remove(os.path.join(run_dir, MSD_SETTINGS_FILE_NAME))
+        print()
+    # Report on the meta-analyses
+    if len(incomplete_file_names) > 0:
+        print('WARNING: Some instances did not complete enough runs to be included in the analyses:')
+        for filename in sorted(incomplete_file_names):
+            print('*', filename)
+    null_paramset_ids = set(range(num_paramsets)) - set(results.keys())
+    if len(null_paramset_ids) == num_paramsets:
+        print()
+        print('ERROR: None of the parameter sets completed any runs; there is nothing to analyse.')
+        print()
+        print('Press any key to return to the main menu.')
+        input('> ')
+        return
+    elif len(null_paramset_ids) > 0:
+        print()
+        print('WARNING: Some parameter sets did not complete any runs, or had no usable trajectories for recomputing MSDs:')
+        for paramset_id in sorted(null_paramset_ids):
+            print('* PS' + str(paramset_id))
+    print()
+    print('The run counts for each parameter set are:')
+    for paramset_id in range(num_paramsets):
+        if paramset_id in results.keys():
+            print('* PS' + str(paramset_id) + ':', results[paramset_id]['n'])
+        else:
+            print('* PS' + str(paramset_id) + ': NONE')
+    print()
+    print('Press any key to continue.')
+    input('> ')
+    # Load discrepancies from file
+    try:
+        discrepancies = load_discrepancies(run_dir)
+    except:
+        print('ERROR: Failed to read', DISCREPANCIES_FILE_NAME)
+        print()
+        print('Press any key to return to the main menu.')
+        input('> ')
+        return
+    # Get graph specifics, offering to reuse the stored ones
+    plot_settings = load_plot_settings(run_dir)
+    if plot_settings is not None:
+        clear_screen()
+        print('Stored plot settings:')
+        print('* Title:', plot_settings['axis_label'])
+        print('* Values:', ', '.join(str(plot_settings['axis_values'].get(x, x)) for x in results.keys()))
+        print('* Linear regression:', plot_settings['do_linreg'])
+        print('* Individual graphs:', plot_settings['do_individual_graphs'])
+        print()
+        print('Use stored plot settings?')
+        if input('> ').strip().upper() not in [ 'Y', 'YES' ]:
+            plot_settings = None
+    if plot_settings is None:
+        plot_settings = prompt_plot_settings(list(results.keys()), discrepancies)
+        save_plot_settings(run_dir, plot_settings)
+    print('Analysing results...')
+    print()
+    # Create the results directory and write the results, discarding them if anything goes wrong
+    results_dir = create_results_dir(run_dir)
+    try:
+        write_results(results_dir, results)
+        plot_results(results_dir, results, plot_settings)
+    except BaseException:
+        shutil.rmtree(results_dir, ignore_errors=True)
+        raise
+    publish_results_dir(run_dir, results_dir)
     input('Done. Press any key to continue.')
 
 
+def run_analysis(job_set_name, job_set, num_processes=1):
+    # Non-interactive analysis using the stored plot settings, or sensible defaults if there are none
+    run_dir = os.path.join(SIMULATIONS_DIR, job_set_name)
+    results, incomplete_file_names = aggregate_results(run_dir, job_set['num_paramsets'], num_processes)
+    # Tuning sweeps are only tabulated; choosing a profile is left to analyse()
+    if job_set['mode'] == MODE_TUNING:
+        results_dir = create_results_dir(run_dir)
+        write_tuning_results(results_dir, aggregate_tuning_results(job_set, results))
+        publish_results_dir(run_dir, results_dir)
+        return results, incomplete_file_names
+    msd_settings = load_msd_settings(run_dir)
+    if msd_settings is not None:
+        results = apply_trajectory_msds(run_dir, job_set['num_paramsets'], results, msd_settings, num_processes)
+    if len(results) == 0:
+        return results, incomplete_file_names
+    plot_settings = load_plot_settings(run_dir)
+    if plot_settings is None:
+        try:
+            discrepancies = load_discrepancies(run_dir)
+        except OSError:
+            discrepancies = [ ]
+        plot_settings = default_plot_settings(job_set['num_paramsets'], discrepancies)
+    results_dir = create_results_dir(run_dir)
+    try:
+        write_results(results_dir, results)
+        plot_results(results_dir, results, plot_settings, num_processes)
+    except BaseException:
+        shutil.rmtree(results_dir, ignore_errors=True)
+        raise
+    publish_results_dir(run_dir, results_dir)
+    return results, incomplete_file_names
+
+
+def job_set_activity_mtime(job_set_path):
+    # Instances create files in these directories when they start and finish, which updates their modification times
+    mtimes = [ ]
+    for dir_name in (OUTPUT_DIR_NAME, 'output_std'):
+        dir_path = os.path.join(job_set_path, dir_name)
+        if os.path.isdir(dir_path):
+            mtimes.append(os.stat(dir_path).st_mtime)
+    return max(mtimes) if len(mtimes) > 0 else None
+
+
+def watch():
+    clear_screen()
+    title('WATCH')
+    if inotify_simple is not None:
+        inotify = inotify_simple.INotify()
+        watch_flags = inotify_simple.flags.CREATE | inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.MOVED_TO
+        print('Watching', SIMULATIONS_DIR, 'with inotify.')
+    else:
+        inotify = None
+        print('Watching', SIMULATIONS_DIR, 'by polling every', WATCH_POLL_INTERVAL, 'seconds.')
+    print('Job-sets that finish running will be analysed with their stored plot settings.')
+    print('Press Ctrl+C to stop.')
+    print()
+    watch_descriptors = { } # Job-set names keyed by inotify watch descriptor
+    watched_dir_paths = set()
+    watch_states = { } # Keyed by job-set name
+    first_pass = True
+    try:
+        while True:
+            # Collect job-sets with filesystem activity since the last pass
+            active_job_set_names = set()
+            job_set_names = sorted(x for x in os.listdir(SIMULATIONS_DIR) if os.path.isdir(os.path.join(SIMULATIONS_DIR, x)))
+            if inotify is not None:
+                for job_set_name in job_set_names:
+                    for dir_name in (OUTPUT_DIR_NAME, 'output_std'):
+                        dir_path = os.path.join(SIMULATIONS_DIR, job_set_name, dir_name)
+                        if dir_path not in watched_dir_paths and os.path.isdir(dir_path):
+                            watch_descriptors[inotify.add_watch(dir_path, watch_flags)] = job_set_name
+                            watched_dir_paths.add(dir_path)
+                if not first_pass:
+                    # Reloads start at least WATCH_POLL_INTERVAL apart, so busy job-sets are not reloaded back to back
+                    time.sleep(max(reload_time + WATCH_POLL_INTERVAL - time.time(), 0))
+                    for event in inotify.read(timeout=WATCH_POLL_INTERVAL*1000):
+                        if event.wd in watch_descriptors:
+                            active_job_set_names.add(watch_descriptors[event.wd])
+            else:
+                if not first_pass:
+                    time.sleep(WATCH_POLL_INTERVAL)
+                for job_set_name in job_set_names:
+                    mtime = job_set_activity_mtime(os.path.join(SIMULATIONS_DIR, job_set_name))
+                    if job_set_name in watch_states and mtime != watch_states[job_set_name]['mtime']:
+                        active_job_set_names.add(job_set_name)
+                    if job_set_name in watch_states:
+                        watch_states[job_set_name]['mtime'] = mtime
+            # Reclassify new job-sets, running job-sets that are active or have not been checked for a while,
+            # and job-sets whose analysis is to be retried
+            now = time.time()
+            reload_time = now
+            for job_set_name in job_set_names:
+                watch_state = watch_states.get(job_set_name)
+                if watch_state is not None:
+                    if watch_state['classification'] != CLF_RUNNING and watch_state['analysis_attempts'] is None:
+                        continue
+                    if job_set_name not in active_job_set_names and now - watch_state['last_checked'] < WATCH_RECHECK_INTERVAL:
+                        continue
+                    watch_state['last_checked'] = now
+                try:
+                    job_set = load_job_set(job_set_name)
+                except (ValueError, OSError):
+                    continue # Probably still being queued; try again on the next pass
+                except Exception as e:
+                    log(job_set_name, 'could not be loaded:', repr(e))
+                    continue
+                JOB_SETS[job_set_name] = job_set
+                if watch_state is None:
+                    watch_states[job_set_name] = { 'classification' : job_set['classification'],
+                                                   'last_checked' : now,
+                                                   'mtime' : job_set_activity_mtime(os.path.join(SIMULATIONS_DIR, job_set_name)),
+                                                   'analysis_attempts' : None } # Counted while the job-set awaits analysis
+                    if not first_pass:
+                        log(job_set_name, 'found (' + job_set['classification'] + ')')
+                    continue
+                watch_state['classification'] = job_set['classification']
+                if job_set['classification'] != CLF_PENDING:
+                    watch_state['analysis_attempts'] = None # Running again, or analysed elsewhere
+                    continue
+                if watch_state['analysis_attempts'] is None:
+                    # The job-set has just moved from running to pending analysis
+                    if job_set['analysis_job_id'] is not None:
+                        log(job_set_name, 'finished running; left to analysis job', job_set['analysis_job_id'])
+                        continue
+                    watch_state['analysis_attempts'] = 0
+                    log(job_set_name, 'finished running; analysing...')
+                else:
+                    log(job_set_name, 'retrying analysis (attempt ' + str(watch_state['analysis_attempts']+1) + ' of ' + str(WATCH_ANALYSIS_ATTEMPTS) + ')...')
+                watch_state['analysis_attempts'] += 1
+                try:
+                    results, incomplete_file_names = run_analysis(job_set_name, job_set)
+                except Exception as e:
+                    results, incomplete_file_names = [ ], [ ]
+                    log(job_set_name, 'analysis failed:', repr(e))
+                else:
+                    if len(results) == 0:
+                        log(job_set_name, 'has no completed runs; nothing to analyse yet')
+                if len(results) == 0:
+                    if watch_state['analysis_attempts'] >= WATCH_ANALYSIS_ATTEMPTS:
+                        watch_state['analysis_attempts'] = None
+                        log(job_set_name, 'giving up after', WATCH_ANALYSIS_ATTEMPTS, 'attempts; analyse it manually')
+                    continue
+                watch_state['classification'] = CLF_FINISHED
+                watch_state['analysis_attempts'] = None
+                log(job_set_name, 'analysed', '(' + str(len(results)) + ' of ' + str(job_set['num_paramsets']) + ' parameter sets, ' + str(len(incomplete_file_names)) + ' incomplete output files)')
+            first_pass = False
+    except KeyboardInterrupt:
+        print()
+        print('Stopped watching.')
+    finally:
+        if inotify is not None:
+            inotify.close()
+    print()
+
+
+def analyse_job_set(job_set_name):
+    # Entry point for analysis jobs, which use every core SLURM has given them
+    num_processes = int(os.environ.get('SLURM_CPUS_PER_TASK', 1))
+    if not os.path.isfile(os.path.join(SIMULATIONS_DIR, job_set_name, JOB_SET_INFO_FILE_NAME)):
+        print('ERROR: No job-set named', job_set_name, 'was found in', SIMULATIONS_DIR)
+        return 1
+    try:
+        job_set = load_job_set(job_set_name)
+    except ValueError as e:
+        print('ERROR:', e)
+        return 1
+    print('Analysing job-set', job_set_name, 'with', num_processes, 'process(es)...')
+    results, incomplete_file_names = run_analysis(job_set_name, job_set, num_processes)
+    for filename in sorted(incomplete_file_names):
+        print('WARNING: Incomplete output file:', filename)
+    if len(results) == 0:
+        print('ERROR: None of the parameter sets completed any runs; there is nothing to analyse.')
+        return 1
+    print('Analysed', len(results), 'of', job_set['num_paramsets'], 'parameter sets.')
+    return 0
+
+
 def cancel():
     clear_screen()
     title('CANCEL')
@@ -798,16 +1879,24 @@ def cancel():
     job_set = JOB_SETS[job_set_name]
     jobs = job_set['jobs']
     job_group_ids = set([ job['job_group_id'] for job in jobs.values() ])
+    job_group_partitions = { job['job_group_id'] : job['partition'] for job in jobs.values() }
     print()
     print('The following job groups will be cancelled:')
     for job_group_id in job_group_ids:
-        print('*', job_group_id)
+        if job_group_partitions[job_group_id] is None:
+            print('*', job_group_id)
+        else:
+            print('*', job_group_id, '(' + job_group_partitions[job_group_id] + ')')
+    if job_set['analysis_job_id'] is not None:
+        print('*', job_set['analysis_job_id'], '(analysis job)')
     print()
     print('Are you sure you want to do this?')
     should_continue = input('> ').strip().upper() in ['Y', 'YES']
     if not should_continue:
         return
     job_group_ids_str = ','.join(str(x) for x in job_group_ids)
+    if job_set['analysis_job_id'] is not None:
+        job_group_ids_str += ',' + str(job_set['analysis_job_id'])
     p = subprocess.Popen([ 'scancel', job_group_ids_str ], stdout=subprocess.PIPE)
     stdout, stderr = p.communicate()
     print()
@@ -816,5 +1905,14 @@ def cancel():
 
 if __name__ == '__main__':
     setup_environment()
+    if '--watch' in sys.argv[1:]:
+        watch()
+        exit(0)
+    if '--analyse' in sys.argv[1:]:
+        job_set_names = sys.argv[sys.argv.index('--analyse')+1:]
+        if len(job_set_names) != 1 or job_set_names[0].startswith('--'):
+            print('Usage: python ' + os.path.basename(__file__) + ' --analyse JOB_SET_NAME')
+            exit(2)
+        exit(analyse_job_set(job_set_names[0]))
     while True:
         main_menu()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""
+Notes:
+* Samples live resource usage of running instances with sstat and squeue, one pair of queries per instance
+* The queries are run concurrently with asyncio, with at most SAMPLER_MAX_PROCESSES subprocesses alive at once
+* sstat's MaxRSS is the peak since the job started and includes non-heap JVM memory (metaspace, thread stacks,
+  code cache), so instances are only flagged when that peak nears the heap limit plus NON_HEAP_ALLOWANCE_MB; a
+  flag means the heap has been close to full at some point, not necessarily that it still is
+* This lives outside of main.py because the async syntax would stop the Python 2 check in main.py from being reached
+"""
+
+import asyncio
+
+
+SAMPLER_MAX_PROCESSES = 8
+LOW_CPU_FRACTION = 0.5
+PEAK_RSS_FRACTION = 0.9
+NON_HEAP_ALLOWANCE_MB = 256 # Typical metaspace, thread stack and code cache usage on top of -Xmx
+FLAG_LOW_CPU = 'LOW_CPU'
+FLAG_PEAK_RSS = 'PEAK_RSS'
+MEMORY_UNITS_MB = { 'K' : 1/1024, 'M' : 1, 'G' : 1024, 'T' : 1024**2 }
+
+
+def parse_duration(duration_str):
+    # SLURM durations take the form [DD-][HH:]MM:SS[.sss]
+    duration_str = duration_str.strip()
+    if len(duration_str) == 0:
+        return None
+    days = 0
+    if '-' in duration_str:
+        days_str, duration_str = duration_str.split('-', 1)
+        days = int(days_str)
+    seconds = sum(float(x) * 60**i for i, x in enumerate(reversed(duration_str.split(':'))))
+    return days * 86400 + seconds
+
+
+def parse_memory(memory_str):
+    # SLURM memory values are a number with an optional K/M/G/T suffix (bytes if there is none)
+    memory_str = memory_str.strip().upper()
+    if len(memory_str) == 0:
+        return None
+    if memory_str[-1] in MEMORY_UNITS_MB:
+        return float(memory_str[:-1]) * MEMORY_UNITS_MB[memory_str[-1]]
+    return float(memory_str) / 1024**2
+
+
+async def run_command(args, semaphore):
+    async with semaphore:
+        try:
+            p = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+        except OSError:
+            return ''
+        stdout, stderr = await p.communicate()
+    return stdout.decode()
+
+
+async def sample_instance(job_id, job, semaphore):
+    job_alloc_num_str = str(job['job_alloc_num'])
+    squeue_stdout, sstat_stdout = await asyncio.gather(
+        run_command([ 'squeue', '-j', job_alloc_num_str, '-h', '-o', '%N|%C|%M' ], semaphore),
+        run_command([ 'sstat', '-j', job_alloc_num_str + '.batch', '-o', 'AveCPU,MaxRSS', '-P', '--noheader' ], semaphore))
+    sample = { 'node' : None,
+               'cpus' : None,
+               'time_elapsed' : None,
+               'cpu_seconds' : None,
+               'rss_mb' : None }
+    for line in squeue_stdout.split('\n'):
+        if line.count('|') != 2:
+            continue
+        node, cpus_str, time_elapsed_str = line.strip().split('|')
+        sample['node'] = node
+        sample['cpus'] = int(cpus_str)
+        sample['time_elapsed'] = parse_duration(time_elapsed_str)
+        break
+    for line in sstat_stdout.split('\n'):
+        if line.count('|') != 1:
+            continue
+        cpu_time_str, max_rss_str = line.strip().split('|')
+        sample['cpu_seconds'] = parse_duration(cpu_time_str)
+        sample['rss_mb'] = parse_memory(max_rss_str)
+        break
+    return job_id, sample
+
+
+async def sample_instances(jobs, max_processes):
+    # The semaphore must be created inside the running loop on older Python 3 releases
+    semaphore = asyncio.Semaphore(max_processes)
+    return await asyncio.gather(*[ sample_instance(job_id, job, semaphore) for job_id, job in jobs.items() ])
+
+
+def sample_job_set(jobs, heap_mbs, max_processes=SAMPLER_MAX_PROCESSES):
+    # heap_mbs gives the JVM heap size for each parameter set, indexed by parameter set ID
+    running_jobs = { job_id : job for job_id, job in jobs.items() if job['state'] == 'RUNNING' and job['job_alloc_num'] is not None }
+    if len(running_jobs) == 0:
+        return { }
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        samples = dict(loop.run_until_complete(sample_instances(running_jobs, max_processes)))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    # Derive utilisation and flag instances that look misconfigured
+    for job_id, sample in samples.items():
+        heap_mb = heap_mbs[jobs[job_id]['paramset_id']]
+        sample['cpus_used'] = None
+        sample['cpu_utilisation'] = None
+        sample['flags'] = [ ]
+        if sample['cpus'] and sample['time_elapsed'] and sample['cpu_seconds'] is not None:
+            sample['cpus_used'] = sample['cpu_seconds'] / sample['time_elapsed']
+            sample['cpu_utilisation'] = sample['cpus_used'] / sample['cpus']
+            if sample['cpu_utilisation'] < LOW_CPU_FRACTION:
+                sample['flags'].append(FLAG_LOW_CPU)
+        if sample['rss_mb'] is not None and sample['rss_mb'] >= PEAK_RSS_FRACTION * (heap_mb + NON_HEAP_ALLOWANCE_MB):
+            sample['flags'].append(FLAG_PEAK_RSS)
+    return samples
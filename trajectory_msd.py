@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+"""
+Notes:
+* Recomputes MSDs from the raw trajectories written when EXPORT_TRAJECTORIES is enabled
+* Trajectory files are expected in the output directory, named like the XML output files but ending in
+  TRAJECTORY_FILE_SUFFIX, as CSV with a header row containing RUN, PROTEIN, T and two or three position
+  columns (X, Y and optionally Z, in metres); rows for each protein in each run must be contiguous and in time order
+* Each CSV is converted once into a .npy cache next to it, which is then memory-mapped and processed in
+  blocks of whole trajectories, so memory use is bounded by TRAJECTORY_CHUNK_ROWS rather than the file size
+* Files without the required header columns are skipped with a warning
+* Files are processed in parallel; each returns running sums which are combined exactly afterwards
+"""
+
+import os
+import itertools
+import multiprocessing
+
+import numpy as np
+
+
+TRAJECTORY_FILE_SUFFIX = '_trajectories.csv'
+TRAJECTORY_CACHE_SUFFIX = '.npy'
+TRAJECTORY_CHUNK_ROWS = 1000000
+KEY_COLUMN_NAMES = ('RUN', 'PROTEIN')
+TIME_COLUMN_NAME = 'T'
+POSITION_COLUMN_NAMES = ('X', 'Y', 'Z')
+POSITION_SCALE = 1E6 # Metres to micrometres, to match the MSD units used elsewhere
+MSD_KIND_ENSEMBLE = 'ensemble'
+MSD_KIND_TIME_AVERAGED = 'time_averaged'
+
+
+def find_trajectory_files(output_dir, paramset_id):
+    file_names = sorted(x for x in os.listdir(output_dir) if x.endswith(TRAJECTORY_FILE_SUFFIX) and ('paramset-' + str(paramset_id) + '_') in x)
+    return [ os.path.join(output_dir, x) for x in file_names ]
+
+
+def read_header(csv_path):
+    with open(csv_path, 'r') as infile:
+        return [ x.strip().upper() for x in infile.readline().split(',') ]
+
+
+def has_required_columns(header):
+    return all(x in header for x in KEY_COLUMN_NAMES + (TIME_COLUMN_NAME,) + POSITION_COLUMN_NAMES[:2])
+
+
+def load_trajectory_array(csv_path):
+    # Convert to a binary cache in fixed-size chunks, then memory-map it
+    # The temporary file is per process, as the watcher and an analysis job may both build the same cache
+    cache_path = csv_path + TRAJECTORY_CACHE_SUFFIX
+    tmp_cache_path = cache_path + '.' + str(os.getpid()) + '.tmp'
+    if not os.path.isfile(cache_path) or os.path.getmtime(cache_path) < os.path.getmtime(csv_path):
+        num_cols = len(read_header(csv_path))
+        with open(csv_path, 'r') as infile:
+            num_rows = sum(1 for line in infile if len(line.strip()) > 0) - 1
+        array = np.lib.format.open_memmap(tmp_cache_path, mode='w+', dtype=np.float64, shape=(max(num_rows, 0), num_cols))
+        with open(csv_path, 'r') as infile:
+            infile.readline()
+            lines = (line for line in infile if len(line.strip()) > 0)
+            row = 0
+            while row < num_rows:
+                chunk = list(itertools.islice(lines, TRAJECTORY_CHUNK_ROWS))
+                values = np.loadtxt(chunk, delimiter=',', ndmin=2)
+                array[row:row+len(values)] = values
+                row += len(values)
+        array.flush()
+        del array
+        os.replace(tmp_cache_path, cache_path)
+    return np.load(cache_path, mmap_mode='r')
+
+
+def iter_trajectory_blocks(array, key_cols, chunk_rows):
+    # Yields consecutive blocks of rows, each holding only whole trajectories
+    num_rows = array.shape[0]
+    start = 0
+    while start < num_rows:
+        end = min(start + chunk_rows, num_rows)
+        while True:
+            block = np.asarray(array[start:end])
+            if end == num_rows or np.any(array[end, key_cols] != array[end-1, key_cols]):
+                cut = len(block)
+                break
+            keys = block[:, key_cols]
+            boundaries = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+            if len(boundaries) > 0:
+                cut = boundaries[-1]
+                break
+            end = min(end + chunk_rows, num_rows) # A single trajectory is longer than the chunk
+        yield block[:cut]
+        start += cut
+
+
+def grow(array, size):
+    if len(array) >= size:
+        return array
+    return np.concatenate([ array, np.zeros(size - len(array)) ])
+
+
+def file_msd_sums(args):
+    csv_path, lag_stride, max_lag, runs = args
+    header = read_header(csv_path)
+    key_cols = [ header.index(x) for x in KEY_COLUMN_NAMES ]
+    time_col = header.index(TIME_COLUMN_NAME)
+    position_cols = [ header.index(x) for x in POSITION_COLUMN_NAMES if x in header ]
+    array = load_trajectory_array(csv_path)
+    sums = { 'ensemble_sum' : np.zeros(0),
+             'ensemble_sq_sum' : np.zeros(0),
+             'ensemble_count' : np.zeros(0),
+             'time_averaged_sum' : np.zeros(0),
+             'time_averaged_sq_sum' : np.zeros(0),
+             'time_averaged_count' : np.zeros(0),
+             'time_step' : None,
+             'runs' : set() }
+    # Samples are evenly spaced, so the sampling interval can be taken from the first trajectory
+    if array.shape[0] > 1 and np.all(array[0, key_cols] == array[1, key_cols]):
+        sums['time_step'] = float(array[1, time_col] - array[0, time_col])
+    max_lag_samples = None
+    if max_lag is not None and sums['time_step']:
+        max_lag_samples = int(round(max_lag / sums['time_step']))
+    for block in iter_trajectory_blocks(array, key_cols, TRAJECTORY_CHUNK_ROWS):
+        if runs is not None:
+            block = block[np.isin(block[:, key_cols[0]], list(runs))]
+        if len(block) == 0:
+            continue
+        sums['runs'].update(int(x) for x in np.unique(block[:, key_cols[0]]))
+        keys = block[:, key_cols]
+        boundaries = np.concatenate([ [ 0 ], np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1, [ len(block) ] ])
+        lengths = np.diff(boundaries)
+        # Stack trajectories of equal length so each lag is a single vectorised operation
+        for length in np.unique(lengths):
+            starts = boundaries[:-1][lengths == length]
+            rows = starts[:, None] + np.arange(length)[None, :]
+            positions = block[:, position_cols][rows] * POSITION_SCALE # (trajectories, samples, dimensions)
+            lag_indices = np.arange(0, length, lag_stride)
+            if max_lag_samples is not None:
+                lag_indices = lag_indices[lag_indices <= max_lag_samples]
+            num_lags = len(lag_indices)
+            for name in ('ensemble_sum', 'ensemble_sq_sum', 'ensemble_count', 'time_averaged_sum', 'time_averaged_sq_sum', 'time_averaged_count'):
+                sums[name] = grow(sums[name], num_lags)
+            # Ensemble: displacement from each trajectory's starting position
+            squared_displacements = np.sum((positions[:, lag_indices, :] - positions[:, :1, :])**2, axis=2)
+            sums['ensemble_sum'][:num_lags] += squared_displacements.sum(axis=0)
+            sums['ensemble_sq_sum'][:num_lags] += (squared_displacements**2).sum(axis=0)
+            sums['ensemble_count'][:num_lags] += len(starts)
+            # Time-averaged: mean over all pairs of samples separated by the lag, within each trajectory
+            for i, lag in enumerate(lag_indices):
+                if lag == 0:
+                    tamsds = np.zeros(len(starts))
+                else:
+                    tamsds = np.sum((positions[:, lag:, :] - positions[:, :-lag, :])**2, axis=2).mean(axis=1)
+                sums['time_averaged_sum'][i] += tamsds.sum()
+                sums['time_averaged_sq_sum'][i] += (tamsds**2).sum()
+                sums['time_averaged_count'][i] += len(starts)
+    return sums
+
+
+def compute_msds(trajectory_paths, lag_stride=1, max_lag=None, runs=None, num_processes=1):
+    # trajectory_paths is keyed by group (e.g. parameter set ID); returns MSDs and their S.D.s for each group
+    file_args = [ ]
+    for key, paths in trajectory_paths.items():
+        for path in paths:
+            if not has_required_columns(read_header(path)):
+                print('WARNING: Skipping ' + path + ', which does not have ' + ', '.join(KEY_COLUMN_NAMES + (TIME_COLUMN_NAME,) + POSITION_COLUMN_NAMES[:2]) + ' columns')
+                continue
+            file_args.append((key, path))
+    args = [ (path, lag_stride, max_lag, runs) for key, path in file_args ]
+    if num_processes > 1 and len(args) > 1:
+        with multiprocessing.Pool(num_processes) as pool:
+            file_sums = pool.map(file_msd_sums, args)
+    else:
+        file_sums = [ file_msd_sums(x) for x in args ]
+    # Combine the running sums of every file in each group
+    msds = { }
+    for (key, path), sums in zip(file_args, file_sums):
+        if key not in msds:
+            msds[key] = { 'time_step' : None, 'runs' : set() }
+        group = msds[key]
+        for name in ('ensemble_sum', 'ensemble_sq_sum', 'ensemble_count', 'time_averaged_sum', 'time_averaged_sq_sum', 'time_averaged_count'):
+            size = max(len(group.get(name, [ ])), len(sums[name]))
+            group[name] = grow(group.get(name, np.zeros(0)), size)
+            group[name][:len(sums[name])] += sums[name]
+        if group['time_step'] is None:
+            group['time_step'] = sums['time_step']
+        group['runs'].update((path, x) for x in sums['runs'])
+    for key, group in msds.items():
+        group['n'] = len(group['runs'])
+        num_lags = int(np.count_nonzero(group.get('ensemble_count', np.zeros(0))))
+        time_step = group['time_step'] if group['time_step'] is not None else 0
+        group['timepoints'] = [ round(x * lag_stride * time_step, 9) for x in range(num_lags) ]
+        for kind in (MSD_KIND_ENSEMBLE, MSD_KIND_TIME_AVERAGED):
+            count = group[kind + '_count'][:num_lags]
+            mean = group[kind + '_sum'][:num_lags] / count
+            variance = np.maximum(group[kind + '_sq_sum'][:num_lags] / count - mean**2, 0)
+            group[kind + '_msds'] = mean.tolist()
+            group[kind + '_stds'] = np.sqrt(variance).tolist()
+    return msds